@@ -0,0 +1,144 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2025.                            (c) 2025.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+The CFHT-specific options in config.yml, read from the same file as the caom2pipe options.
+"""
+
+import os
+import yaml
+
+from caom2pipe import manage_composable as mc
+
+
+__all__ = ['CFHTConfig', 'get_option', 'OPTIONS']
+
+
+# option name: default value
+OPTIONS = {
+    # the number of threads that construct the per-extension WCS of a FITS file - 1 means serial construction
+    'wcs_workers': 1,
+    # 'ds9' renders every image preview with ds9, 'numpy' renders the single-image and MegaPrime mosaic previews
+    # in-process, and the rest with ds9
+    'preview_renderer': 'ds9',
+    # the number of HDUs the numpy renderer reads and reduces in parallel, when building a mosaic
+    'mosaic_workers': 4,
+    # > 1 to calculate the SITELLE cube channel medians from every n-th row and column
+    'sitelle_median_stride': 1,
+    # the number of long-lived ds9 processes to render previews with - 0 starts a new ds9 for every image
+    'ds9_pool_size': 0,
+    # True to record the science file checksum in the previews, and to not generate previews again when the previews
+    # at CADC were generated from the same science file content, with the same preview_version
+    'preview_skip_current': False,
+    # change this when a change to preview generation should cause all previews to be generated again
+    'preview_version': '1',
+    # > 0 to decompress, and recompress, .gz files in-process when storing them, compressing this many HDUs at once.
+    # 0 leaves the work to gunzip and imcopy.
+    'recompression_workers': 0,
+    # True to read and map the observation while a file is stored, for STORE + INGEST of files that are stored as
+    # they are, without (de)compression. The observation is stored after the file is.
+    'overlap_store': False,
+    # > 0 for store_modified_files_only to compare the md5 checksums of a directory of files to the CADC checksums
+    # with one query per this many files - 0 checks one file at a time, with data_client.info
+    'holdings_batch_size': 0,
+    # the table, and the TAP service, queried for the CADC checksums
+    'holdings_table': 'inventory.Artifact',
+    'holdings_resource_id': 'ivo://cadc.nrc.ca/global/luskan',
+}
+
+
+class CFHTConfig(mc.Config):
+    """
+    A caom2pipe Config, with the OPTIONS as attributes. An option that is not in config.yml has its default value.
+    """
+
+    def __init__(self):
+        super().__init__()
+        for name, value in OPTIONS.items():
+            setattr(self, name, value)
+
+    def get_executors(self):
+        result = super().get_executors()
+        config_fqn = os.path.join(os.getcwd(), 'config.yml')
+        if os.path.exists(config_fqn):
+            with open(config_fqn) as f:
+                content = yaml.safe_load(f)
+            if content is not None:
+                for name in OPTIONS:
+                    if name in content:
+                        setattr(self, name, content.get(name))
+        return result
+
+
+def get_option(config, name):
+    """
+    :param config: CFHTConfig, or a Config without the CFHT options, or None
+    :param name: str one of the OPTIONS
+    :return: the value of the option, or the default value, if config does not have the option
+    """
+    return getattr(config, name, OPTIONS[name])
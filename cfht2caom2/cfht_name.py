@@ -69,7 +69,9 @@
 import h5py
 import logging
 
-from os.path import basename, join
+from concurrent.futures import ThreadPoolExecutor
+from os import makedirs, unlink
+from os.path import basename, exists, join
 from re import match
 from urllib.parse import urlparse
 
@@ -78,7 +80,9 @@ from caom2pipe.execute_composable import CaomExecuteRunnerMeta
 from caom2pipe.execute_composable import MetaVisitRunnerMeta, NoFheadStoreVisitRunnerMeta, OrganizeExecutesRunnerMeta
 from caom2pipe.execute_composable import NoFheadScrapeRunnerMeta, NoFheadVisitRunnerMeta
 from caom2pipe.manage_composable import build_uri, CadcException, get_keyword, StorageName, TaskType
+from cfht2caom2.cfht_config import get_option
 from cfht2caom2.metadata import Inst
+from cfht2caom2.recompression import can_recompress, decompress, recompress
 
 
 __all__ = ['CFHTName']
@@ -605,6 +609,9 @@ class CFHTNoFheadStoreVisitRunnerMeta(NoFheadStoreVisitRunnerMeta):
 
     def __init__(self, clients, config, data_visitors, meta_visitors, reporter, store_transferrer):
         super().__init__(config, clients, store_transferrer, meta_visitors, data_visitors, reporter)
+        self._recompression_workers = get_option(config, 'recompression_workers')
+        # the files written by _recompress
+        self._recompressed = []
 
     def _set_preconditions(self):
         """This is probably not the best approach, but I want to think about where the optimal location for the
@@ -641,6 +648,55 @@ class CFHTNoFheadStoreVisitRunnerMeta(NoFheadStoreVisitRunnerMeta):
             self._storage_name._descriptors[uri] = descriptors.get(source_name)
         self._logger.debug('End _set_preconditions')
 
+    def _store_data(self):
+        if self._recompression_workers > 0:
+            # store the in-process (re)compressed files, which are named as they will be at CADC, so no further
+            # compression work happens, then restore the original source names, for the clean up of the sources
+            source_names = self._storage_name.source_names
+            try:
+                self._storage_name.source_names = self._recompress()
+                super()._store_data()
+            finally:
+                self._storage_name.source_names = source_names
+                # the source clean up does not know about the files written by _recompress
+                for fqn in self._recompressed:
+                    if exists(fqn):
+                        unlink(fqn)
+                self._recompressed = []
+        else:
+            super()._store_data()
+
+    def _recompress(self):
+        """
+        :return: the source names, with each .gz file replaced by the decompressed, or recompressed, file in the
+            working directory
+        """
+        result = []
+        for index, source_name in enumerate(self._storage_name.source_names):
+            uri = self._storage_name.destination_uris[index]
+            headers = self._storage_name.metadata.get(uri)
+            if not source_name.endswith('.gz') or headers is None:
+                result.append(source_name)
+                continue
+            local_fqn = join(self._working_dir, basename(uri))
+            if local_fqn.endswith('.gz'):
+                result.append(source_name)
+            elif local_fqn.endswith('.fz'):
+                if can_recompress(headers):
+                    makedirs(self._working_dir, exist_ok=True)
+                    self._recompressed.append(local_fqn)
+                    recompress(source_name, local_fqn, self._recompression_workers)
+                    result.append(local_fqn)
+                else:
+                    self._logger.info(f'{source_name} has scaled pixels. Using imcopy.')
+                    result.append(source_name)
+            else:
+                makedirs(self._working_dir, exist_ok=True)
+                self._recompressed.append(local_fqn)
+                decompress(source_name, local_fqn)
+                result.append(local_fqn)
+        return result
+
 
 class CFHTNoFheadScrapeRunnerMeta(NoFheadScrapeRunnerMeta):
     """Defines a pipeline step for all the operations that require access to the file on disk for metdata and data
@@ -760,6 +816,7 @@ class CFHTStoreIngestRunnerMeta(CFHTNoFheadStoreVisitRunnerMeta):
 
     def __init__(self, clients, config, meta_visitors, reporter, store_transferrer):
         super().__init__(clients, config, None, meta_visitors, reporter, store_transferrer)
+        self._overlap_store = get_option(config, 'overlap_store')
 
     def execute(self, context):
         self._logger.debug('begin execute with the steps:')
@@ -768,9 +825,35 @@ class CFHTStoreIngestRunnerMeta(CFHTNoFheadStoreVisitRunnerMeta):
         self._logger.debug('set the preconditions')
         self._set_preconditions()
 
-        self._logger.debug('store the input files')
-        self._store_data()
+        stored_as_is = all(
+            basename(source_name) == basename(uri)
+            for source_name, uri in zip(self._storage_name.source_names, self._storage_name.destination_uris)
+        )
+        if self._overlap_store and stored_as_is:
+            # storing files that need no (de)compression changes nothing the mapping uses, so map while storing
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix='store') as store_executor:
+                self._logger.debug('store the input files, while the observation is mapped')
+                stored = store_executor.submit(self._store_data)
+                try:
+                    self._map()
+                except Exception:
+                    # waits for the store, so a failed store is reported, rather than hidden by the mapping failure
+                    if stored.exception() is not None:
+                        self._logger.error(f'Store of {self._storage_name.file_name} failed: {stored.exception()}')
+                    raise
+                self._logger.debug('wait for the input files to be stored')
+                stored.result()
+        else:
+            self._logger.debug('store the input files')
+            self._store_data()
+            self._map()
+
+        self._logger.debug('store the updated xml')
+        self._caom2_store()
+
+        self._logger.debug('End execute.')
 
+    def _map(self):
         self._logger.debug('get the observation for the existing model')
         self._caom2_read()
 
@@ -780,11 +863,6 @@ class CFHTStoreIngestRunnerMeta(CFHTNoFheadStoreVisitRunnerMeta):
         self._logger.debug('write the observation to disk for debugging')
         self._write_model()
 
-        self._logger.debug('store the updated xml')
-        self._caom2_store()
-
-        self._logger.debug('End execute.')
-
 
 class CFHTOrganizeExecutesRunnerMeta(OrganizeExecutesRunnerMeta):
     """A class that extends OrganizeExecutes to handle the choosing of the correct executors based on the config.yml.
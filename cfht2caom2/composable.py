@@ -72,11 +72,12 @@ import traceback
 
 from caom2pipe import client_composable as clc
 from caom2pipe.data_source_composable import LocalFilesDataSourceRunnerMeta
-from caom2pipe.manage_composable import Config, StorageName, TaskType
+from caom2pipe.manage_composable import StorageName, TaskType
 from caom2pipe import run_composable as rc
-from cfht2caom2 import cleanup_augmentation
+from cfht2caom2 import cleanup_augmentation, data_source
 from cfht2caom2 import espadons_energy_augmentation, preview_augmentation
 from cfht2caom2 import file2caom2_augmentation
+from cfht2caom2.cfht_config import CFHTConfig, get_option
 from cfht2caom2.cfht_name import CFHTName
 
 
@@ -99,7 +100,7 @@ def can_use_single_visit(task_types):
 
 
 def _common_init():
-    config = Config()
+    config = CFHTConfig()
     config.get_executors()
     StorageName.collection = config.collection
     StorageName.scheme = config.scheme
@@ -108,7 +109,11 @@ def _common_init():
     clients = clc.ClientCollection(config)
     sources = []
     if config.use_local_files:
-        source = LocalFilesDataSourceRunnerMeta(config, clients.data_client, storage_name_ctor=CFHTName)
+        if config.store_modified_files_only and get_option(config, 'holdings_batch_size') > 0:
+            holdings = data_source.inventory_holdings(config)
+            source = data_source.CFHTLocalFilesDataSource(config, clients.data_client, holdings)
+        else:
+            source = LocalFilesDataSourceRunnerMeta(config, clients.data_client, storage_name_ctor=CFHTName)
         sources.append(source)
     return config, clients, sources
 
@@ -0,0 +1,290 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2020.                            (c) 2020.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Decide, for a whole directory of files at once, which local files need storing when the pipeline is configured with
+store_modified_files_only.
+
+The LocalFilesDataSourceRunnerMeta does this one file at a time, with a data_client.info call per file, before any
+other work starts. Here the local md5 checksums are calculated in parallel, and compared to the CADC checksums with
+one query per batch of file URIs.
+"""
+
+import csv
+import hashlib
+import io
+import logging
+import os
+
+from cadctap import CadcTapClient
+from cadcutils import net
+from concurrent.futures import ThreadPoolExecutor
+
+from caom2pipe.data_source_composable import LocalFilesDataSourceRunnerMeta
+from caom2pipe.manage_composable import build_uri, CadcException, StorageName
+from cfht2caom2.cfht_config import get_option
+from cfht2caom2.cfht_name import CFHTName
+
+
+__all__ = [
+    'CFHTLocalFilesDataSource',
+    'LocalHoldings',
+    'TapHoldings',
+    'inventory_holdings',
+    'local_md5',
+    'modified_files',
+    'CHECKSUM_WORKERS',
+]
+
+
+# the number of threads that calculate local md5 checksums
+CHECKSUM_WORKERS = 4
+# bytes to read at a time when calculating a checksum
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def local_md5(fqn):
+    """
+    :param fqn: str fully-qualified name of a local file
+    :return: str the hex md5 checksum of the file
+    """
+    md5 = hashlib.md5()
+    with open(fqn, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _strip(checksum):
+    return None if checksum is None else checksum.replace('md5:', '')
+
+
+class LocalHoldings:
+    """
+    CADC checksums from a dict, for testing, and for comparisons against a known list of files.
+    """
+
+    def __init__(self, checksums):
+        """
+        :param checksums: dict of file URI: md5 checksum, with or without the 'md5:' prefix
+        """
+        self._checksums = {uri: _strip(checksum) for uri, checksum in checksums.items()}
+        self.query_count = 0
+
+    def checksums(self, uris):
+        """
+        :param uris: list of file URIs
+        :return: dict of file URI: md5 checksum, for the URIs with a CADC checksum
+        """
+        self.query_count += 1
+        return {uri: self._checksums[uri] for uri in uris if uri in self._checksums}
+
+
+class TapHoldings:
+    """
+    CADC checksums from a TAP service, with one query per batch of file URIs.
+    """
+
+    def __init__(self, tap_client, table):
+        self._tap_client = tap_client
+        self._table = table
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def checksums(self, uris):
+        """
+        :param uris: list of file URIs
+        :return: dict of file URI: md5 checksum, for the URIs with a CADC checksum
+        """
+        quoted = ', '.join("'{}'".format(uri.replace("'", "''")) for uri in uris)
+        query_string = f'SELECT uri, contentChecksum FROM {self._table} WHERE uri IN ({quoted})'
+        self._logger.debug(f'Query checksums for {len(uris)} files.')
+        buffer = io.StringIO()
+        try:
+            self._tap_client.query(query_string, output_file=buffer, data_only=True, response_format='csv')
+        except Exception as e:
+            raise CadcException(f'Could not query {self._table} for checksums: {e}')
+        result = {}
+        for row in csv.DictReader(io.StringIO(buffer.getvalue())):
+            if row.get('contentChecksum'):
+                result[row['uri']] = _strip(row['contentChecksum'])
+        return result
+
+
+def inventory_holdings(config):
+    """
+    :param config: CFHTConfig
+    :return: TapHoldings for the config.yml holdings_table, queried with a TAP client for the holdings_resource_id
+        service, and the proxy certificate. The storage inventory is where files are stored, so it has their
+        checksums before any observation refers to them.
+    """
+    subject = net.Subject(certificate=config.proxy_fqn)
+    tap_client = CadcTapClient(subject, resource_id=get_option(config, 'holdings_resource_id'))
+    return TapHoldings(tap_client, get_option(config, 'holdings_table'))
+
+
+def _destination_uri(fqn):
+    """
+    :return: the CADC file URI of a local file, or None, if it is not known until the file is stored. A gzipped file
+        is stored decompressed, or tile-compressed, depending on its BITPIX, so the md5 checksum of the local file
+        never matches the one at CADC.
+    """
+    f_name = os.path.basename(fqn)
+    if f_name.endswith('.gz'):
+        return None
+    return build_uri(scheme=StorageName.scheme, archive=StorageName.collection, file_name=f_name)
+
+
+def modified_files(fqns, holdings, workers=CHECKSUM_WORKERS, batch_size=1):
+    """
+    :param fqns: list of fully-qualified local file names
+    :param holdings: LocalHoldings or TapHoldings
+    :param workers: int number of threads that calculate local md5 checksums
+    :param batch_size: int number of file URIs per holdings query
+    :return: set of the fqns that are not at CADC with the same md5 checksum, and so need storing
+    """
+    result = set()
+    candidates = {}
+    for fqn in fqns:
+        uri = _destination_uri(fqn)
+        if uri is None:
+            result.add(fqn)
+        else:
+            candidates[uri] = fqn
+    if len(candidates) == 0:
+        return result
+
+    uris = list(candidates.keys())
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # start the local checksums, so the queries overlap with them
+        local = executor.map(local_md5, candidates.values())
+        cadc = {}
+        step = max(1, batch_size)
+        for index in range(0, len(uris), step):
+            cadc.update(holdings.checksums(uris[index : index + step]))
+        for uri, checksum in zip(uris, local):
+            if cadc.get(uri) != checksum:
+                result.add(candidates[uri])
+    logging.info(f'{len(result)} of {len(fqns)} files need storing.')
+    return result
+
+
+class CFHTLocalFilesDataSource(LocalFilesDataSourceRunnerMeta):
+    """
+    Replace the per-file data_client.info check for store_modified_files_only with a check of the whole directory
+    the first time one of its files is checked. Files that are added, or changed, after the directory is checked, are
+    checked again, with the files that are new since the last check.
+    """
+
+    def __init__(
+        self,
+        config,
+        cadc_client,
+        holdings,
+        storage_name_ctor=CFHTName,
+        workers=CHECKSUM_WORKERS,
+    ):
+        super().__init__(config, cadc_client, storage_name_ctor=storage_name_ctor)
+        self._holdings = holdings
+        self._workers = workers
+        self._batch_size = get_option(config, 'holdings_batch_size')
+        # fqn: (os.stat key, needs storing)
+        self._checked = {}
+
+    def _check_md5sum(self, entry_path):
+        """
+        :return: boolean False if the file is at CADC with the same md5 checksum, True otherwise
+        """
+        checked = self._checked.get(entry_path)
+        if checked is None or checked[0] != _stat_key(entry_path):
+            self._check_directory(os.path.dirname(entry_path))
+            checked = self._checked.get(entry_path)
+        return True if checked is None else checked[1]
+
+    def _check_directory(self, directory):
+        keys = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.') and self._has_extension(entry.name):
+                    key = _stat_key(entry.path)
+                    checked = self._checked.get(entry.path)
+                    if checked is None or checked[0] != key:
+                        keys[entry.path] = key
+        logging.debug(f'Check md5 checksums for {len(keys)} files in {directory}.')
+        modified = modified_files(list(keys.keys()), self._holdings, self._workers, self._batch_size)
+        for fqn, key in keys.items():
+            self._checked[fqn] = (key, fqn in modified)
+
+    @staticmethod
+    def _has_extension(f_name):
+        extensions = StorageName.data_source_extensions
+        return extensions is None or any(f_name.endswith(extension) for extension in extensions)
+
+
+def _stat_key(fqn):
+    s = os.stat(fqn)
+    return s.st_mtime_ns, s.st_size
@@ -0,0 +1,293 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+
+
+"""
+A pool of long-lived Xvfb + ds9 processes, driven over XPA, so that rendering a preview with ds9 does not pay the
+cost of starting an X server and ds9, and of loading the file, for every image.
+
+Each server is checked with xpaaccess before it is used, and is re-started if the process has gone away, or if it
+stops answering.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+
+from contextlib import contextmanager
+
+from caom2pipe import manage_composable as mc
+
+
+__all__ = ['Ds9Pool', 'Ds9Server', 'get_pool', 'xpa_commands']
+
+
+# seconds to wait for a new ds9 to answer on XPA
+STARTUP_TIMEOUT = 60
+# seconds to wait for one XPA command - the same as the timeout for a one-off ds9 command line
+COMMAND_TIMEOUT = 900
+
+
+def xpa_commands(
+    in_science_fqn,
+    geometry,
+    save_fqn,
+    scope_param,
+    rotate_param,
+    zoom_param='to fit',
+    pan_param='',
+    mosaic_param='',
+    mode_param='-mode none',
+    scale_param='',
+):
+    """
+    Translate the ds9 command-line parameters of CFHTPreview._gen_image into XPA commands.
+
+    :return: (load, view) where load is the list of commands that load the file, and view is the list of commands
+        that set up the display and save the image
+    """
+    load = ['frame clear']
+    mosaic = mosaic_param.split()
+    if len(mosaic) == 0:
+        load.append(f'fits {in_science_fqn}')
+    elif mosaic[0] == '-fits':
+        # '-fits', or '-fits file[n]' to display only HDU n
+        load.append(f'fits {mosaic[1] if len(mosaic) > 1 else in_science_fqn}')
+    else:
+        # '-mosaicimage iraf'
+        load.append(f'{mosaic[0][1:]} {" ".join(mosaic[1:])} {in_science_fqn}')
+
+    width, height = geometry.split('x')
+    view = [f'width {width}', f'height {height}', 'rotate 0', 'frame center']
+    if rotate_param:
+        view.append(rotate_param[1:])
+    view += [
+        'scale squared',
+        f'scale mode {scale_param}',
+        f'scale scope {scope_param}',
+        'scale datasec yes',
+        'cmap invert yes',
+    ]
+    if mode_param:
+        view.append(mode_param[1:])
+    view += ['view colorbar no', f'zoom {zoom_param}']
+    if pan_param:
+        # relative to the centre, as on the command line
+        view.append(pan_param[1:])
+    view.append(f'saveimage jpeg {save_fqn}')
+    return load, view
+
+
+def _file_state(load):
+    """:return list of (fqn, modification time, size) for each existing file that the load commands read"""
+    result = []
+    # the first command is 'frame clear', the file name is the last word of the others
+    for command in load[1:]:
+        fqn = command.split()[-1].split('[')[0]
+        if os.path.isfile(fqn):
+            stat = os.stat(fqn)
+            result.append((fqn, stat.st_mtime_ns, stat.st_size))
+    return result
+
+
+class Ds9Server:
+    """One Xvfb + ds9 process, addressed over XPA by its title."""
+
+    def __init__(self, title):
+        self._title = title
+        self._process = None
+        self._loaded = None
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def title(self):
+        return self._title
+
+    def start(self):
+        self._logger.debug(f'Starting ds9 {self._title}.')
+        self._process = subprocess.Popen(
+            ['xvfb-run', '-a', 'ds9', '-title', self._title],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self._loaded = None
+        end = time.time() + STARTUP_TIMEOUT
+        while time.time() < end:
+            if self.is_healthy():
+                return
+            time.sleep(0.5)
+        self.stop()
+        raise mc.CadcException(f'ds9 {self._title} did not start in {STARTUP_TIMEOUT} seconds.')
+
+    def stop(self):
+        if self._process is not None:
+            self._logger.debug(f'Stopping ds9 {self._title}.')
+            try:
+                self._process.terminate()
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            self._process = None
+        self._loaded = None
+
+    def is_healthy(self):
+        if self._process is None or self._process.poll() is not None:
+            return False
+        try:
+            result = subprocess.run(
+                ['xpaaccess', self._title], capture_output=True, text=True, timeout=10
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        return result.stdout.strip() == 'yes'
+
+    def ensure(self):
+        """Re-start the ds9 process if it is not answering."""
+        if not self.is_healthy():
+            self.stop()
+            self.start()
+
+    def xpaset(self, command):
+        try:
+            subprocess.run(
+                ['xpaset', '-p', self._title] + shlex.split(command),
+                check=True,
+                capture_output=True,
+                timeout=COMMAND_TIMEOUT,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise mc.CadcException(f'ds9 {self._title} failed to execute {command}: {e}')
+
+    def render(self, load, view):
+        # thumbnails and previews of the same file and mosaic share one load, as long as the file has not been
+        # written again since, e.g. by a re-run, or for the next _zoom.fits
+        loaded = (load, _file_state(load))
+        if self._loaded != loaded:
+            self._loaded = None
+            for command in load:
+                self.xpaset(command)
+            self._loaded = loaded
+        for command in view:
+            self.xpaset(command)
+
+
+class Ds9Pool:
+    """A fixed number of Ds9Servers, handed out one per caller."""
+
+    def __init__(self, size):
+        self._servers = queue.Queue()
+        self._all = []
+        for index in range(size):
+            server = Ds9Server(f'cfht2caom2_{os.getpid()}_{index}')
+            self._all.append(server)
+            self._servers.put(server)
+
+    @contextmanager
+    def server(self):
+        server = self._servers.get()
+        try:
+            server.ensure()
+            yield server
+        except Exception:
+            # leave no half-configured ds9 behind
+            server.stop()
+            raise
+        finally:
+            self._servers.put(server)
+
+    def gen_image(self, in_science_fqn, geometry, save_fqn, *args, **kwargs):
+        """Same parameters, and result, as CFHTPreview._gen_image."""
+        load, view = xpa_commands(in_science_fqn, geometry, save_fqn, *args, **kwargs)
+        if os.path.exists(save_fqn):
+            os.unlink(save_fqn)
+        with self.server() as server:
+            server.render(load, view)
+        return 1 if os.path.exists(save_fqn) else 0
+
+    def close(self):
+        for server in self._all:
+            server.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(size):
+    """:return the Ds9Pool for this process, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = Ds9Pool(size)
+            atexit.register(_pool.close)
+    return _pool
@@ -67,14 +67,20 @@
 
 import copy
 import logging
+import numpy as np
 
 from astropy.io import fits
-from caom2 import Axis, Chunk, CoordAxis1D, ObservableAxis, Observation, Slice, SpectralWCS
-from caom2pipe import astro_composable as ac
+from caom2 import Axis, Chunk, CoordAxis1D, CoordBounds1D, CoordRange1D, ObservableAxis, Observation, RefCoord, Slice
+from caom2 import SpectralWCS
 from caom2pipe import manage_composable as mc
 from cfht2caom2 import metadata as md
 
 
+# wavelength coverage is split into separate bounds samples where the spacing between sorted wavelengths is more than
+# this many times the median spacing, relative to the wavelength
+GAP_FACTOR = 3.0
+
+
 def visit(observation, **kwargs):
     mc.check_param(observation, Observation)
 
@@ -135,21 +141,11 @@ def _do_energy(artifact, science_fqn, storage_name):
     # then advanced users would have to dig in the info to understand
     # range is first and last bounds.
 
-    # read in the complete fits file, including the data
     logging.info(f'Reading ESPaDOnS energy data from {science_fqn}.')
     count = 0
-    hdus = fits.open(science_fqn, memmap=True, lazy_load_hdus=False)
-    if hdus[0].data is not None:
-        wave = hdus[0].data[0, :].copy()
-        del hdus[0].data
-    else:
-        wave = hdus[1].data[0, :].copy()
-        del hdus[1].data
-    hdr = hdus[0].header.copy()
-    hdus.close()
-    del hdus
+    wave, hdr = _read_wavelengths(science_fqn)
     axis = Axis('WAVE', 'nm')
-    coord_bounds = ac.build_chunk_energy_bounds(wave)
+    coord_bounds = build_energy_bounds(wave)
     coord_axis = CoordAxis1D(axis=axis, bounds=coord_bounds)
     resolving_power = get_energy_resolving_power(hdr)
     chunk = artifact.parts['0'].chunks[0]
@@ -182,9 +178,9 @@ def _do_energy(artifact, science_fqn, storage_name):
         dependent = Slice(dependent_axis, 3)
         independent_axis = Axis('WAVE', 'nm')
         independent = Slice(independent_axis, 1)
-        new_chunk = copy.deepcopy(chunk)
+        # the energy is the same for both chunks, so share it, instead of copying all the bounds
+        new_chunk = copy.deepcopy(chunk, {id(chunk.energy): chunk.energy})
         new_chunk.observable = ObservableAxis(dependent, independent)
-        new_chunk.energy = chunk.energy
         new_chunk._id = Chunk._gen_id()
         artifact.parts['0'].chunks.append(new_chunk)
         count += 1
@@ -194,6 +190,48 @@ def _do_energy(artifact, science_fqn, storage_name):
     return count
 
 
+def build_energy_bounds(wave, gap_factor=GAP_FACTOR):
+    """
+    :param wave: 1-D array of wavelengths, in any order, as from the overlapping ESPaDOnS echelle orders
+    :param gap_factor: float how much wider than the median spacing, relative to the wavelength, the spacing between
+        two sorted wavelengths has to be, to be a gap in the coverage
+    :return: CoordBounds1D with one sample per contiguous range of wavelength coverage
+    """
+    x = np.sort(wave[np.isfinite(wave)])
+    bounds = CoordBounds1D()
+    if x.size == 0:
+        return bounds
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spacing = np.diff(x) / np.abs(x[1:])
+    positive = spacing[spacing > 0]
+    if positive.size == 0:
+        gaps = np.array([], dtype=int)
+    else:
+        gaps = np.flatnonzero(spacing > gap_factor * np.median(positive))
+    starts = np.concatenate(([0], gaps + 1))
+    ends = np.concatenate((gaps, [x.size - 1]))
+    for start, end in zip(x[starts], x[ends]):
+        bounds.samples.append(CoordRange1D(RefCoord(0.5, float(start)), RefCoord(1.5, float(end))))
+    return bounds
+
+
+def _read_wavelengths(science_fqn):
+    """
+    :return: the wavelength row (row 1) of the spectrum, and a copy of the primary header. Only that row is read from
+        the file, except for tile-compressed files, which are decompressed in full.
+    """
+    # without a memory map, so that scaled data may be read through a section
+    with fits.open(science_fqn, memmap=False) as hdus:
+        hdr = hdus[0].header.copy()
+        hdu = hdus[0] if hdus[0].header.get('NAXIS', 0) > 0 else hdus[1]
+        if isinstance(hdu, fits.CompImageHDU):
+            wave = hdu.data[0, :].copy()
+        else:
+            # the section interface reads only the requested row from the file
+            wave = hdu.section[0, :]
+    return wave, hdr
+
+
 def get_energy_resolving_power(header):
     result = None
     obstype = header.get('OBSTYPE')
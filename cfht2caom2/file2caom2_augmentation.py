@@ -66,15 +66,66 @@
 # ***********************************************************************
 #
 
+from concurrent.futures import ThreadPoolExecutor
+
 from caom2utils import caom2blueprint
+from caom2utils.wcs_parsers import FitsWcsParser
 from caom2pipe import caom_composable as cc
+from cfht2caom2.cfht_config import get_option
 from cfht2caom2.instruments import factory
 from cfht2caom2.metadata import Inst
 
 
+__all__ = ['CFHTFits2caom2Visitor', 'CFHTFitsParser', 'visit']
+
+
+class CFHTFitsParser(caom2blueprint.FitsParser):
+    """
+    Construct the per-extension WCS of a FITS file with a pool of threads. This pays off for the MegaPrime mosaics
+    and WIRCam guide cubes, which have tens of HDUs each, when there are few, large, files to process.
+
+    Parts are added, and Chunks augmented, serially and in HDU order, so the resulting Parts and Chunks are the same
+    as those from a FitsParser.
+    """
+
+    def __init__(self, src, obs_blueprint=None, uri=None, workers=1):
+        super().__init__(src, obs_blueprint, uri)
+        self._workers = workers
+
+    def augment_artifact(self, artifact):
+        if self._workers <= 1 or len(self.headers) <= 1:
+            return super().augment_artifact(artifact)
+
+        self.logger.debug(f'Begin artifact augmentation for {artifact.uri} with {len(self.headers)} HDUs.')
+        if self.blueprint.get_configed_axes_count() == 0:
+            raise TypeError(f'No WCS Data. End artifact augmentation for {artifact.uri}.')
+
+        indices = []
+        for index in range(len(self.headers)):
+            if self.add_parts(artifact, index):
+                indices.append(index)
+            else:
+                # artifact-level attributes still require updating
+                caom2blueprint.BlueprintParser.augment_artifact(self, artifact)
+
+        if len(indices) > 0:
+            with ThreadPoolExecutor(max_workers=min(self._workers, len(indices))) as executor:
+                wcs_parsers = executor.map(self._make_wcs_parser, indices)
+                # map returns results in submission order, so the assignment is deterministic
+                for index, wcs_parser in zip(indices, wcs_parsers):
+                    self._wcs_parsers[index] = wcs_parser
+        caom2blueprint.ContentParser.augment_artifact(self, artifact)
+        self.logger.debug(f'End artifact augmentation for {artifact.uri}.')
+
+    def _make_wcs_parser(self, index):
+        return FitsWcsParser(self.headers[index], self.file, str(index))
+
+
 class CFHTFits2caom2Visitor(cc.Fits2caom2VisitorRunnerMeta):
     def __init__(self, observation, **kwargs):
         super().__init__(observation, **kwargs)
+        # config.yml wcs_workers
+        self._wcs_workers = get_option(self._config, 'wcs_workers')
 
     def _get_mappings(self, dest_uri):
         return factory(
@@ -94,8 +145,11 @@ class CFHTFits2caom2Visitor(cc.Fits2caom2VisitorRunnerMeta):
         elif '_diag' in self._storage_name.file_name:
             parser = caom2blueprint.BlueprintParser(blueprint, uri)
         else:
+            headers = self._storage_name.metadata.get(uri)
             if self._storage_name.instrument == Inst.UNSUPPORTED:
                 parser = caom2blueprint.BlueprintParser(blueprint, uri)
+            elif self._wcs_workers > 1 and headers is not None and len(headers) > 1:
+                parser = CFHTFitsParser(headers, blueprint, uri, self._wcs_workers)
             else:
                 parser = super()._get_parser(blueprint, uri)
         self._logger.debug(f'Using a {parser.__class__.__name__} for {self._storage_name.file_uri}')
@@ -175,20 +175,25 @@ SF 12-04-21
 
 """
 
+import copy
 import logging
 import math
 import os
+import re
 
+import erfa
 from astropy import units
 from astropy.io import fits
+from astropy.time.utils import day_frac
+from datetime import datetime
 from enum import Enum
-from re import match
+from functools import lru_cache
 
 from caom2 import Axis, Chunk, DataProductType
 from caom2 import CoordAxis2D, CoordRange2D, RefCoord, SpatialWCS, Coord2D
 from caom2 import TemporalWCS, CoordAxis1D, CoordFunction1D, CoordError
 from caom2 import CalibrationLevel, ProductType, ObservationIntentType
-from caom2 import DerivedObservation
+from caom2 import Artifact, DerivedObservation, Plane, TypedOrderedDict
 from caom2utils.caom2blueprint import update_artifact_meta
 from caom2utils.blueprints import ObsBlueprint
 from caom2utils.wcs_parsers import FitsWcsParser
@@ -204,8 +209,130 @@ from cfht2caom2.espadons_energy_augmentation import get_energy_resolving_power
 __all__ = ['factory', 'InstrumentType']
 
 
+# FILENAM* values that identify an input, see _repair_filename_provenance_value
+FILENAME_PROVENANCE = re.compile('[0-9]{5,7}o')
+# YYYY-MM-DD, optionally followed by [T ]hh:mm:ss[.ffffff], the formats of the CFHT date keywords
+ISO_DATETIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{1,2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?)?')
+
+
+def _iso_datetime(value):
+    """:return: datetime, or None if the value is not one of the ISO_DATETIME formats, so mc.make_datetime is
+    required."""
+    result = None
+    found = ISO_DATETIME.fullmatch(value) if isinstance(value, str) else None
+    if found is not None:
+        year, month, day, hour, minute, second, fraction = found.groups()
+        try:
+            result = datetime(
+                int(year),
+                int(month),
+                int(day),
+                int(hour or 0),
+                int(minute or 0),
+                int(second or 0),
+                int((fraction or '0').ljust(6, '0')),
+            )
+        except ValueError:
+            # e.g. '1970-00-01', leave it to make_datetime
+            result = None
+    return result
+
+
+@lru_cache(maxsize=4096)
+def _cfht_time(ip):
+    dt = _iso_datetime(ip)
+    if dt is None:
+        dt = mc.make_datetime(ip)
+    return ac.get_datetime_mjd(dt)
+
+
 def cfht_time_helper(ip):
-    return ac.get_datetime_mjd(mc.make_datetime(ip))
+    """The same header values are converted many times for a file, so remember the results.
+
+    :return: astropy Time, in mjd format, or None. Each caller gets its own copy of the remembered instance.
+    """
+    result = _cfht_time(ip)
+    return None if result is None else result.copy()
+
+
+@lru_cache(maxsize=4096)
+def cfht_mjd(ip):
+    """For when only the MJD value is required, this avoids the astropy Time construction. It's the same computation
+    astropy does for a UTC datetime, so the result is identical to cfht_time_helper(ip).value.
+
+    :return: float MJD, or None
+    """
+    dt = _iso_datetime(ip)
+    if dt is None:
+        temp = _cfht_time(ip)
+        result = None if temp is None else temp.value
+    else:
+        jd1, jd2 = erfa.dtf2d('UTC', dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second + dt.microsecond / 1e6)
+        jd1, jd2 = day_frac(jd1, jd2)
+        result = float((jd1 - erfa.DJM0) + jd2)
+    return result
+
+
+@lru_cache(maxsize=4096)
+def cfht_to_mjd(value):
+    """ac.to_mjd, remembered. The result is shared, so do not modify it."""
+    return ac.to_mjd(value)
+
+
+@lru_cache(maxsize=1)
+def _cfht_geocentric_location():
+    return ac.get_geocentric_location('cfht')
+
+
+# ObsBlueprint instances, fully accumulated, keyed by AuxiliaryType._blueprint_key. Built once per process.
+_blueprint_templates = {}
+# the getter functions referenced by each template, by name, with the same keys as _blueprint_templates
+_blueprint_getters = {}
+# ObsBlueprint data members set from the constructor parameters that identify the instance executing the blueprint,
+# rather than the blueprint content - these keep their values when a template is copied
+_BLUEPRINT_INSTANCE_MEMBERS = ['_module', '_module_instance', '_update']
+
+
+class BlueprintGetters:
+    """The blueprint getter functions of one mapping instance, bound once.
+
+    The parser finds blueprint functions by name on ObsBlueprint._module_instance. Using an instance of this class
+    there makes each of those look-ups a single dictionary access, instead of a walk of the mapping class hierarchy
+    followed by a bound method construction, for every key and every extension.
+    """
+
+    def __init__(self, mapping, getters):
+        self._mapping = mapping
+        for name, getter in getters.items():
+            setattr(self, name, getter.__get__(mapping))
+
+    def __getattr__(self, name):
+        if name == '_mapping':
+            # not yet initialized, e.g. copy
+            raise AttributeError(name)
+        # anything else the parser may want, it should find on the mapping instance
+        return getattr(self._mapping, name)
+
+
+def _find_blueprint_getters(mapping_class, bp):
+    """Resolve every function referenced by a blueprint, to a function of mapping_class.
+
+    :return: dict of getter name: function
+    :raise mc.CadcException if a referenced function is not defined by mapping_class
+    """
+    values = [(key, value) for key, value in bp._plan.items()]
+    for extension in bp._extensions.values():
+        values.extend(extension.items())
+    result = {}
+    for key, value in values:
+        if ObsBlueprint.is_function(value):
+            name = value.split('(')[0]
+            if name not in result:
+                getter = getattr(mapping_class, name, None)
+                if not callable(getter):
+                    raise mc.CadcException(f'{mapping_class.__name__} has no blueprint function {value} for {key}.')
+                result[name] = getter
+    return result
 
 
 class ProvenanceType(Enum):
@@ -265,6 +392,31 @@ class CFHTValueRepair(mc.ValueRepairCache):
         self._values = None
         self._logger = logging.getLogger(self.__class__.__name__)
 
+    def repair_file(self, observation, storage_name):
+        """Repair the Observation-level values, and the values of the Plane and Artifact of one file.
+
+        The other Planes and Artifacts were repaired when their files were ingested, so for the duration of the
+        inherited repair, the Observation holds only the Plane of this file, and that Plane holds only the Artifact of
+        this file. This keeps the cost of the repair independent of the number of files that already make up the
+        Observation.
+        """
+        all_planes = observation.planes
+        plane = all_planes.get(storage_name.product_id)
+        all_artifacts = None if plane is None else plane.artifacts
+        try:
+            observation.planes = TypedOrderedDict(Plane)
+            if plane is not None:
+                plane.artifacts = TypedOrderedDict(Artifact)
+                artifact = all_artifacts.get(storage_name.file_uri)
+                if artifact is not None:
+                    plane.artifacts.add(artifact)
+                observation.planes.add(plane)
+            self.repair(observation)
+        finally:
+            observation.planes = all_planes
+            if plane is not None:
+                plane.artifacts = all_artifacts
+
 
 class AuxiliaryType(cc.TelescopeMapping2):
     value_repair = CFHTValueRepair()
@@ -278,6 +430,8 @@ class AuxiliaryType(cc.TelescopeMapping2):
         self._plane = None
         self._extension = None
         self._instrument_start_date = mc.make_datetime('1979-01-01 00:00:00')
+        # values derived from header keywords, see _memoize
+        self._derived_values = {}
 
     @property
     def chunk(self):
@@ -320,6 +474,68 @@ class AuxiliaryType(cc.TelescopeMapping2):
         self._plane = value
 
     def accumulate_blueprint(self, bp):
+        """Configure the ObsBlueprint from a per-process template.
+
+        For a given mapping class and naming profile (see _blueprint_key), the accumulated blueprint differs only by
+        a few per-file values, so build the template once, copy it into bp, and apply the per-file values with
+        _accumulate_file_blueprint. The functions the template references are resolved and checked when the template
+        is built.
+        """
+        key = self._blueprint_key()
+        template = _blueprint_templates.get(key)
+        if template is None:
+            template = ObsBlueprint()
+            self._accumulate_blueprint(template)
+            _blueprint_getters[key] = _find_blueprint_getters(self.__class__, template)
+            _blueprint_templates[key] = template
+            self._logger.debug(f'Built blueprint template for {key}.')
+        clone = copy.deepcopy(template)
+        for name in _BLUEPRINT_INSTANCE_MEMBERS:
+            setattr(clone, name, getattr(bp, name))
+        # bp is the caller's instance, so it takes on the content of the copy
+        vars(bp).update(vars(clone))
+        if bp._module_instance is self:
+            bp._module_instance = BlueprintGetters(self, _blueprint_getters[key])
+        self._accumulate_file_blueprint(bp)
+
+    def _memoize(self, name, header, keywords, derive):
+        """Blueprint functions are evaluated for every extension, and some of them call each other, so remember the
+        results of the derivations that depend only on header keyword values.
+
+        :param name: str identifies the derivation
+        :param header: astropy.io.fits.Header the keyword values come from
+        :param keywords: list of the keywords the derivation depends on. The values are part of the memo key, so a
+            header change, or a header with different values, is a new derivation.
+        :param derive: callable, no parameters, that computes the value
+        """
+        key = (name,) + tuple(header.get(keyword) for keyword in keywords)
+        try:
+            hash(key)
+        except TypeError:
+            # unhashable values, e.g. from HDF5 attributes
+            return derive()
+        if key not in self._derived_values:
+            self._derived_values[key] = derive()
+        return self._derived_values[key]
+
+    def _blueprint_key(self):
+        """The naming profile that determines the content of the accumulated blueprint, except for the values
+        set in _accumulate_file_blueprint."""
+        return (
+            self.__class__,
+            self._storage_name.instrument,
+            self._storage_name.suffix,
+            self._storage_name.raw_time,
+            self._storage_name.simple,
+            self._storage_name.derived,
+            '_' in self._storage_name.file_id,
+        )
+
+    def _accumulate_file_blueprint(self, bp):
+        """Set the blueprint values that change with every file. Called after the template has been copied."""
+        bp.set_default('Observation.sequenceNumber', self._storage_name.sequence_number)
+
+    def _accumulate_blueprint(self, bp):
         """Configure the telescope-specific ObsBlueprint at the CAOM model
         Observation level.
 
@@ -334,7 +550,6 @@ class AuxiliaryType(cc.TelescopeMapping2):
         bp.set('Observation.intent', 'get_obs_intent()')
         bp.set('Observation.metaRelease', 'get_meta_release()')
         bp.add_attribute('Observation.sequenceNumber', 'EXPNUM')
-        bp.set_default('Observation.sequenceNumber', self._storage_name.sequence_number)
         bp.set('Observation.type', 'get_obs_type()')
         bp.set_default('Observation.algorithm.name', None)
         bp.set('Observation.environment.elevation', 'get_environment_elevation()')
@@ -358,7 +573,7 @@ class AuxiliaryType(cc.TelescopeMapping2):
         bp.set('Observation.target_position.point.cval1', 'get_target_position_cval1()')
         bp.set('Observation.target_position.point.cval2', 'get_target_position_cval2()')
         bp.set('Observation.telescope.name', 'CFHT 3.6m')
-        x, y, z = ac.get_geocentric_location('cfht')
+        x, y, z = _cfht_geocentric_location()
         bp.set('Observation.telescope.geoLocationX', x)
         bp.set('Observation.telescope.geoLocationY', y)
         bp.set('Observation.telescope.geoLocationZ', z)
@@ -444,6 +659,11 @@ class AuxiliaryType(cc.TelescopeMapping2):
         return result
 
     def get_obs_intent(self, ext):
+        return self._memoize(
+            'obs_intent', self._headers[ext], ['OBSTYPE', 'RUNID', 'CRUNID'], lambda: self._derive_obs_intent(ext)
+        )
+
+    def _derive_obs_intent(self, ext):
         # CW
         # Determine Observation.intent = obs.intent = "science" or
         # "calibration" phot & astr std & acquisitions/align are calibration.
@@ -608,6 +828,11 @@ class AuxiliaryType(cc.TelescopeMapping2):
         pass
 
     def _get_ra_dec(self, ext):
+        return self._memoize(
+            'ra_dec', self._headers[ext], ['OBJRA', 'OBJDEC', 'OBJRADEC'], lambda: self._derive_ra_dec(ext)
+        )
+
+    def _derive_ra_dec(self, ext):
         obj_ra = self._headers[ext].get('OBJRA')
         obj_dec = self._headers[ext].get('OBJDEC')
         obj_ra_dec = self._headers[ext].get('OBJRADEC')
@@ -633,6 +858,9 @@ class AuxiliaryType(cc.TelescopeMapping2):
         return ra, dec
 
     def _get_run_id(self, ext):
+        return self._memoize('run_id', self._headers[ext], ['RUNID', 'CRUNID'], lambda: self._derive_run_id(ext))
+
+    def _derive_run_id(self, ext):
         run_id = self._headers[ext].get('RUNID')
         if run_id is None:
             run_id = self._headers[ext].get('CRUNID')
@@ -764,24 +992,25 @@ class AuxiliaryType(cc.TelescopeMapping2):
             idx = self._update_observation_metadata()
         self.extension = idx
         self.update_observation()
-        for plane in self._observation.planes.values():
-            if plane.product_id != self._storage_name.product_id:
-                # do only the work for the applicable plane
-                continue
-
+        # do only the work for the applicable plane and artifact
+        plane = self._observation.planes.get(self._storage_name.product_id)
+        if plane is not None:
             self.plane = plane
-            for artifact in plane.artifacts.values():
-                if artifact.uri != self._storage_name.file_uri:
-                    continue
+            artifact = plane.artifacts.get(self._storage_name.file_uri)
+            if artifact is not None:
                 update_artifact_meta(artifact, self._storage_name.file_info.get(self._storage_name.file_uri))
+                self.update_artifact()
 
+                # the time delta comes from the idx header, so it's the same for all the chunks
+                time_delta = None
                 for part in artifact.parts.values():
                     for chunk in part.chunks:
                         if chunk.time is not None and chunk.time.axis is not None and chunk.time.axis.function is not None:
-                            if plane.calibration_level == CalibrationLevel.RAW_STANDARD:
-                                time_delta = self.get_time_refcoord_delta_simple(idx)
-                            else:
-                                time_delta = self.get_time_refcoord_delta_derived(idx)
+                            if time_delta is None:
+                                if plane.calibration_level == CalibrationLevel.RAW_STANDARD:
+                                    time_delta = self.get_time_refcoord_delta_simple(idx)
+                                else:
+                                    time_delta = self.get_time_refcoord_delta_derived(idx)
 
                             cc.undo_astropy_cdfix_call(chunk, time_delta)
                         self.part = part
@@ -790,44 +1019,20 @@ class AuxiliaryType(cc.TelescopeMapping2):
 
             derived_type = self._find_derived_type(self._observation.observation_id)
             if plane.provenance is not None:
-                if derived_type is ProvenanceType.IMCMB:
-                    cc.update_plane_provenance(
-                        plane,
-                        self._headers[1:],
-                        derived_type.value,
-                        self._storage_name.collection,
-                        _repair_imcmb_provenance_value,
-                        self._observation.observation_id,
-                    )
-                elif derived_type is ProvenanceType.COMMENT:
-                    cc.update_plane_provenance_single(
-                        plane,
-                        self._headers,
-                        derived_type.value,
-                        self._storage_name.collection,
-                        _repair_comment_provenance_value,
-                        self._observation.observation_id,
-                    )
-                else:
-                    cc.update_plane_provenance(
-                        plane,
-                        self._headers,
-                        derived_type.value,
-                        self._storage_name.collection,
-                        _repair_filename_provenance_value,
-                        self._observation.observation_id,
-                    )
-                # the derived plane itself is not considered one of the inputs
-                delete_these = []
-                for ip in plane.provenance.inputs:
-                    if ip.get_product_id().endswith(self._storage_name.product_id):
-                        delete_these.append(ip)
-                for entry in delete_these:
-                    plane.provenance.inputs.remove(entry)
+                headers = self._headers[1:] if derived_type is ProvenanceType.IMCMB else self._headers
+                plane_inputs = set()
+                for prov_obs_id, prov_prod_id in _scan_provenance(
+                    headers, derived_type, self._observation.observation_id
+                ):
+                    # the derived plane itself is not considered one of the inputs
+                    if not prov_prod_id.endswith(self._storage_name.product_id):
+                        _, plane_uri = cc.make_plane_uri(prov_obs_id, prov_prod_id, self._storage_name.collection)
+                        plane_inputs.add(plane_uri)
+                mc.update_typed_set(plane.provenance.inputs, plane_inputs)
 
             self.update_plane()
 
-        InstrumentType.value_repair.repair(self._observation)
+        InstrumentType.value_repair.repair_file(self._observation, self._storage_name)
         self._logger.debug('Done update.')
         return self._observation
 
@@ -862,6 +1067,11 @@ class AuxiliaryType(cc.TelescopeMapping2):
             self._logger.warning(f'Invalid date of {value} for {key}.')
             self._observable.rejected.record(mc.Rejected.BAD_METADATA, self._storage_name.file_name)
 
+    def update_artifact(self):
+        """Called once for the artifact of the file being ingested, before update_chunk is called for each of its
+        chunks. Do the work that has the same result for every chunk here."""
+        pass
+
     def update_chunk(self):
         self.update_polarization()
         self.update_time()
@@ -1148,7 +1358,7 @@ class InstrumentType(AuxiliaryType):
         pass
 
     def _get_mjd_obs(self, ext):
-        result = ac.to_mjd(self._headers[ext].get('MJD-OBS'))
+        result = cfht_to_mjd(self._headers[ext].get('MJD-OBS'))
         if not ac.is_good_date(result, self._instrument_start_date, True):
             result = None
         return result
@@ -1172,26 +1382,6 @@ class InstrumentType(AuxiliaryType):
                 break
         return mjd_obs
 
-    def _get_run_id(self, ext):
-        run_id = self._headers[ext].get('RUNID')
-        if run_id is None:
-            run_id = self._headers[ext].get('CRUNID')
-        if run_id is not None:
-            if len(run_id) < 3 or len(run_id) > 9 or run_id == 'CFHT':
-                # a well-known default value that indicates the past, as
-                # specified in
-                # caom2IngestMegacam.py, l392
-                # caom2IngestWircamdetrend.py, l314
-                # caom2IngestEspadons.py, l522
-                self._logger.warning(
-                    f'Setting RUNID to default 17BE for '
-                    f'{self._headers[ext].get("FILENAME")}.'
-                )
-                run_id = '17BE'
-            else:
-                run_id = run_id.strip()
-        return run_id
-
     def _get_types(self, ext):
         dp_result = DataProductType.IMAGE
         pt_result = ProductType.SCIENCE
@@ -1392,11 +1582,11 @@ class EspadonsTemporal(InstrumentType):
 
         bp.set('Chunk.position.equinox', 'get_chunk_position_equinox()')
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the ESPaDOnS-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
 
         bp.configure_time_axis(5)
         self.accumulate_time_chunk_blueprint(bp)
@@ -1560,7 +1750,7 @@ class EspadonsTemporal(InstrumentType):
                     temp = mjd_start1
                 else:
                     temp = mjd_date1
-                mjd_obs = ac.to_mjd(temp)
+                mjd_obs = cfht_to_mjd(temp)
         else:
             for index, value in enumerate([self._get_mjd_obs(ext), 'DATE-OBS', 'HSTTIME', 'DATE']):
                 if index == 0:
@@ -1624,8 +1814,8 @@ class EspadonsTemporal(InstrumentType):
 
 
 class EspadonsSpectralTemporal(EspadonsTemporal):
-    def accumulate_blueprint(self, bp):
-        super().accumulate_blueprint(bp)
+    def _accumulate_blueprint(self, bp):
+        super()._accumulate_blueprint(bp)
         if self._storage_name.suffix is not None:
             bp.configure_energy_axis(1)
             # caom2IngestEspadons.py l636
@@ -1657,8 +1847,8 @@ class EspadonsSpectralTemporal(EspadonsTemporal):
 
 
 class EspadonsSpatialSpectralTemporal(EspadonsSpectralTemporal):
-    def accumulate_blueprint(self, bp):
-        super().accumulate_blueprint(bp)
+    def _accumulate_blueprint(self, bp):
+        super()._accumulate_blueprint(bp)
         bp.configure_position_axes((3, 4))
         self.accumulate_spatial_chunk_blueprint(bp)
         self._logger.debug('Done accumulate_blueprint.')
@@ -1669,8 +1859,8 @@ class EspadonsI(EspadonsTemporal):
     There is no energy axis configuration in this class because chunk.energy is filled in by the
     espadons_energy_augmentation class. The augmentation requires access to the data on disk.
     """
-    def accumulate_blueprint(self, bp):
-        super().accumulate_blueprint(bp)
+    def _accumulate_blueprint(self, bp):
+        super()._accumulate_blueprint(bp)
         bp.configure_position_axes((3, 4))
         self.accumulate_spatial_chunk_blueprint(bp)
         self._logger.debug('Done accumulate_blueprint.')
@@ -1685,8 +1875,8 @@ class EspadonsPolarization(EspadonsTemporal):
     dimension and then the other dimension are actually different quantities, so different things stored in
     different slices of the array, hence different chunks that are subsets of the array.
     """
-    def accumulate_blueprint(self, bp):
-        super().accumulate_blueprint(bp)
+    def _accumulate_blueprint(self, bp):
+        super()._accumulate_blueprint(bp)
         bp.configure_position_axes((3, 4))
         self.accumulate_spatial_chunk_blueprint(bp)
 
@@ -1715,11 +1905,11 @@ class MegaTemporal(InstrumentType):
     def extension(self, value):
         self._extension = value
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the MegaCam/MegaPrime-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
 
         bp.configure_time_axis(3)
         self.accumulate_time_chunk_blueprint(bp)
@@ -1780,12 +1970,20 @@ class MegaTemporal(InstrumentType):
 
 
 class MegaSpectralRangeTemporal(MegaTemporal):
+    def __init__(self, cfht_name, clients, reporter, observation, config):
+        super().__init__(cfht_name, clients, reporter, observation, config)
+        self._filter_md = None
+        self._updated_filter_name = None
+
+    def update_artifact(self):
+        super().update_artifact()
+        # one FILTER value for all the CCDs
+        filter_name = mc.get_keyword(self._headers, 'FILTER')
+        self._filter_md, self._updated_filter_name = get_filter_md(filter_name, self._storage_name)
 
     def update_energy(self):
         # SGo - use range for energy with filter information
-        filter_name = mc.get_keyword(self._headers, 'FILTER')
-        filter_md, updated_filter_name = get_filter_md(filter_name, self._storage_name)
-        cc.build_chunk_energy_range(self._chunk, updated_filter_name, filter_md)
+        cc.build_chunk_energy_range(self._chunk, self._updated_filter_name, self._filter_md)
         if self._chunk.energy is not None:
             self._chunk.energy.ssysobs = 'TOPOCENT'
             self._chunk.energy.ssyssrc = 'TOPOCENT'
@@ -1794,15 +1992,11 @@ class MegaSpectralRangeTemporal(MegaTemporal):
 
 
 class Mega(MegaSpectralRangeTemporal):
-    def __init__(self, cfht_name, clients, reporter, observation, config):
-        super().__init__(cfht_name, clients, reporter, observation, config)
-        self._filter_name = None
-
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the MegaCam/MegaPrime-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         bp.configure_position_axes((1, 2))
         self.accumulate_spatial_chunk_blueprint(bp)
 
@@ -1815,15 +2009,18 @@ class MegaFlag(MegaTemporal):
     """
     Use this class when adding an Artifact for a '*p_flag.fits' file to an existing Observation instance.
     """
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the MegaCam/MegaPrime-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         bp.set('Chunk.energy.axis.function.naxis', 1)
-        self._use_existing_observation(bp)
         self._logger.debug('Done accumulate_blueprint.')
 
+    def _accumulate_file_blueprint(self, bp):
+        super()._accumulate_file_blueprint(bp)
+        self._use_existing_observation(bp)
+
 
 class SitelleTemporal(InstrumentType):
     def __init__(self, cfht_name, clients, reporter, observation, config):
@@ -1839,11 +2036,11 @@ class SitelleTemporal(InstrumentType):
             derived_type = super()._find_derived_type(obs_id)
         return derived_type
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the Sitelle-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
 
         bp.configure_time_axis(4)
         self.accumulate_time_chunk_blueprint(bp)
@@ -1855,10 +2052,6 @@ class SitelleTemporal(InstrumentType):
 
         if self._storage_name.suffix == 'v':
             bp.set('Observation.intent', ObservationIntentType.SCIENCE)
-            bp.set(
-                'Observation.sequenceNumber',
-                self._storage_name.product_id[:-1],
-            )
             bp.clear('Plane.provenance.version')
             bp.add_attribute('Plane.provenance.version', 'PROGRAM')
             bp.set('Artifact.productType', ProductType.SCIENCE)
@@ -1877,6 +2070,11 @@ class SitelleTemporal(InstrumentType):
 
         self._logger.debug('End accumulate_blueprint.')
 
+    def _accumulate_file_blueprint(self, bp):
+        super()._accumulate_file_blueprint(bp)
+        if self._storage_name.suffix == 'v':
+            bp.set('Observation.sequenceNumber', self._storage_name.product_id[:-1])
+
     def get_plane_data_release(self, ext):
         """Release dates can be very long in the past, so don't worry about checking that they're logical, only that
         they're a valid date."""
@@ -2018,11 +2216,11 @@ class SitelleSpectralTemporal(SitelleTemporal):
 
         self._logger.debug('End _update_sitelle_plane')
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the Sitelle-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
 
         bp.configure_energy_axis(3)
         self.accumulate_spectral_chunk_blueprint(bp)
@@ -2134,11 +2332,11 @@ class SitelleSpatialRangeSpectralTemporal(SitelleSpectralTemporal):
 
 class SitelleSpatialFunctionSpectralTemporal(SitelleSpectralTemporal):
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the Sitelle-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         bp.configure_position_axes((1, 2))
         self.accumulate_spatial_chunk_blueprint(bp)
 
@@ -2150,7 +2348,7 @@ class SitelleHdf5(InstrumentType):
         # but existing metadata has a minimum value of 2015-07-08 05:27:09.146880 for 1819176o.fits
         self._instrument_start_date = mc.make_datetime('2015-07-07 00:00:00.000')
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the Sitelle-specific ObsBlueprint at the CAOM model
         Observation level.
         """
@@ -2214,12 +2412,16 @@ class SitelleHdf5(InstrumentType):
 
         self._logger.debug('End accumulate_blueprint.')
 
+    def _accumulate_file_blueprint(self, bp):
+        # the blueprint does not come from AuxiliaryType, so there are no per-file values
+        pass
+
     def _get_datetime(self, ext):
         result = None
         d = self._headers[ext].get('OBS_DATE')
         t = self._headers[ext].get('OBS_TIME')
         if d is not None and t is not None:
-            result = cfht_time_helper(f'{d} {t}').value
+            result = cfht_mjd(f'{d} {t}')
         return result
 
     def _get_energy_resolving_power(self, ext):
@@ -2259,8 +2461,7 @@ class SitelleHdf5(InstrumentType):
             temp = cfht_time_helper(d)
             if program is None or program != 'LP P41':
                 temp = temp + 1 * units.year
-            temp.format = 'isot'
-            result = temp.value
+            result = temp.isot
         return result
 
     def _get_proposal_id(self, ext):
@@ -2294,15 +2495,12 @@ class SitelleHdf5(InstrumentType):
 
         idx = 0
         self.extension = idx
-        for plane in self._observation.planes.values():
-            if plane.product_id != self._storage_name.product_id:
-                # do only the work for the applicable plane
-                continue
-
+        # do only the work for the applicable plane and artifact
+        plane = self._observation.planes.get(self._storage_name.product_id)
+        if plane is not None:
             self.plane = plane
-            for artifact in plane.artifacts.values():
-                if artifact.uri != self._storage_name.file_uri:
-                    continue
+            artifact = plane.artifacts.get(self._storage_name.file_uri)
+            if artifact is not None:
                 update_artifact_meta(artifact, self._storage_name.file_info.get(self._storage_name.file_uri))
 
                 for part in artifact.parts.values():
@@ -2319,7 +2517,7 @@ class SitelleHdf5(InstrumentType):
                             chunk.energy.axis.function = None
             self.update_plane()
 
-        InstrumentType.value_repair.repair(self._observation)
+        InstrumentType.value_repair.repair_file(self._observation, self._storage_name)
         self._logger.debug('Done update.')
         return self._observation
 
@@ -2375,7 +2573,7 @@ class SitelleHdf5(InstrumentType):
 
 class SitelleNoHdf5Metadata(SitelleSpatialFunctionSpectralTemporal):
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the Sitelle-specific ObsBlueprint at the CAOM model
         Observation level.
         """
@@ -2395,20 +2593,22 @@ class SitelleNoHdf5Metadata(SitelleSpatialFunctionSpectralTemporal):
             bp.set('Artifact.productType', ProductType.SCIENCE)
         self._logger.debug('End accumulate_blueprint.')
 
+    def _accumulate_file_blueprint(self, bp):
+        # the blueprint does not come from AuxiliaryType, so there are no per-file values
+        pass
+
     def update(self):
         self._logger.debug('Begin update.')
 
 
         idx = 0
         self.extension = idx
-        for plane in self._observation.planes.values():
-            if plane.product_id != self._storage_name.product_id:
-                # do only the work for the applicable plane
-                continue
+        # do only the work for the applicable plane and artifact
+        plane = self._observation.planes.get(self._storage_name.product_id)
+        if plane is not None:
             self.plane = plane
-            for artifact in plane.artifacts.values():
-                if artifact.uri != self._storage_name.file_uri:
-                    continue
+            artifact = plane.artifacts.get(self._storage_name.file_uri)
+            if artifact is not None:
                 update_artifact_meta(artifact, self._storage_name.file_info.get(self._storage_name.file_uri))
 
         self._update_sitelle_plane()
@@ -2418,11 +2618,11 @@ class SitelleNoHdf5Metadata(SitelleSpatialFunctionSpectralTemporal):
 
 class SitelleP(SitelleSpectralTemporal):
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the Sitelle-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         # caom2IngestSitelle.py l590
         bp.clear('Chunk.energy.axis.axis.ctype')
         bp.add_attribute('Chunk.energy.axis.axis.ctype', 'CTYPE3')
@@ -2535,13 +2735,13 @@ class Spirou(InstrumentType):
         self._extension = value
         self._header = self._headers[value]
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the SPIRou-specific ObsBlueprint at the CAOM model Observation level.
 
         SF 03-03-23
         Add in WCS for 's' files, and spatial WCS for 'g' files.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
 
         bp.set('Observation.target.targetID', '_get_gaia_target_id()')
         bp.add_attribute('Observation.target_position.coordsys', 'RADECSYS')
@@ -2720,8 +2920,8 @@ class Spirou(InstrumentType):
 
 class SpirouTemporal(Spirou):
 
-    def accumulate_blueprint(self, bp):
-        super().accumulate_blueprint(bp)
+    def _accumulate_blueprint(self, bp):
+        super()._accumulate_blueprint(bp)
         bp.configure_time_axis(3)
         super().accumulate_time_chunk_blueprint(bp)
         bp.set('Chunk.time.axis.function.delta', 'get_time_refcoord_delta()')
@@ -2731,25 +2931,25 @@ class SpirouTemporal(Spirou):
 
 class SpirouSpectralTemporal(SpirouTemporal):
 
-    def accumulate_blueprint(self, bp):
-        super().accumulate_blueprint(bp)
+    def _accumulate_blueprint(self, bp):
+        super()._accumulate_blueprint(bp)
         self._accumulate_spectral_chunk_blueprint(bp, 4)
 
 
 class SpirouSpatialSpectralTemporal(SpirouSpectralTemporal):
 
-    def accumulate_blueprint(self, bp):
-        super().accumulate_blueprint(bp)
+    def _accumulate_blueprint(self, bp):
+        super()._accumulate_blueprint(bp)
         self._accumulate_spatial_chunk_blueprint(bp)
 
 
 class SpirouG(Spirou):
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the SPIRou-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         # SF 03-03-23 - use ETYPE, add Spatial WCS support
         bp.clear('Observation.type')
         bp.add_attribute('Observation.type', 'ETYPE')
@@ -2762,13 +2962,21 @@ class SpirouG(Spirou):
         self._accumulate_spectral_chunk_blueprint(bp, 4)
 
     def _get_ra(self, ext):
-        ra, dec = ac.build_ra_dec_as_deg(self._headers[0].get('RA'), self._headers[0].get('DEC'))
+        ra, dec = self._get_pointing()
         return ra
 
     def _get_dec(self, ext):
-        ra, dec = ac.build_ra_dec_as_deg(self._headers[0].get('RA'), self._headers[0].get('DEC'))
+        ra, dec = self._get_pointing()
         return dec
 
+    def _get_pointing(self):
+        return self._memoize(
+            'pointing',
+            self._headers[0],
+            ['RA', 'DEC'],
+            lambda: ac.build_ra_dec_as_deg(self._headers[0].get('RA'), self._headers[0].get('DEC')),
+        )
+
     def update_plane(self):
         pass
 
@@ -2783,7 +2991,7 @@ class SpirouG(Spirou):
         # SF - 22-09-20 - use ETIME
 
         ref_coord_val = mc.get_keyword(self._headers, 'DATE')
-        ref_coord_mjd = cfht_time_helper(ref_coord_val).value
+        ref_coord_mjd = cfht_mjd(ref_coord_val)
 
         if self._chunk.time is None:
             self._chunk.time = TemporalWCS(
@@ -2827,12 +3035,21 @@ class SpirouG(Spirou):
 
 
 class SpirouPolarization(Spirou):
+    # the keyword prefixes for the per-sequence time bounds in each HDU
+    TIME_PREFIXES = ('MJDATE', 'MJDEND')
 
-    def accumulate_blueprint(self, bp):
+    def __init__(self, cfht_name, clients, reporter, observation, config):
+        super().__init__(cfht_name, clients, reporter, observation, config)
+        # EXTNAME => header
+        self._extname_headers = {}
+        # EXTNAME => {prefix: [values]}
+        self._prefix_values = {}
+
+    def _accumulate_blueprint(self, bp):
         """Configure the SPIRou-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         self._accumulate_spatial_chunk_blueprint(bp)
         self._accumulate_spectral_chunk_blueprint(bp, 3)
 
@@ -2862,13 +3079,27 @@ class SpirouPolarization(Spirou):
         # caom2IngestSpirou.py, l557
         return 1.0
 
+    def update_artifact(self):
+        super().update_artifact()
+        # index the HDUs once per file, rather than searching them for every part
+        self._extname_headers = {}
+        self._prefix_values = {}
+        for header in self._headers:
+            extname = header.get('EXTNAME')
+            if extname in self._extname_headers:
+                # the first HDU with an EXTNAME is the one that's used
+                continue
+            self._extname_headers[extname] = header
+            values = {prefix: [] for prefix in SpirouPolarization.TIME_PREFIXES}
+            for keyword in header:
+                for prefix in SpirouPolarization.TIME_PREFIXES:
+                    if keyword.startswith(prefix) and len(keyword) > len(prefix):
+                        values[prefix].append(header.get(keyword))
+            self._prefix_values[extname] = values
+
     def update_polarization(self):
         self._logger.debug(f'Begin update_polarization for {self._storage_name.obs_id}')
-        header = None
-        for h in self._headers:
-            if h.get('EXTNAME') == self.part.name:
-                header = h
-                break
+        header = self._extname_headers.get(self.part.name)
 
         stokes_param = header.get('STOKES')
         if stokes_param is None:
@@ -2913,23 +3144,11 @@ class SpirouPolarization(Spirou):
         # it, and use it everywhere - this matches existing CFHT SPIRou 'p'
         # behaviour
 
-        def _find_keywords_in_header(header, lookup):
-            values = []
-            for keyword in header:
-                if keyword.startswith(lookup) and len(keyword) > len(lookup):
-                    values.append(header.get(keyword))
-            return values
-
-        header = None
-        for h in self._headers:
-            if h.get('EXTNAME') == self.part.name:
-                header = h
-                break
-
+        header = self._extname_headers.get(self.part.name)
         tot_e_time = header.get('TOTETIME')
 
-        lower = _find_keywords_in_header(header, 'MJDATE')
-        upper = _find_keywords_in_header(header, 'MJDEND')
+        lower = self._prefix_values[self.part.name]['MJDATE']
+        upper = self._prefix_values[self.part.name]['MJDEND']
 
         if len(lower) > 0:
             for ii, entry in enumerate(lower):
@@ -2959,12 +3178,14 @@ class WircamTemporal(InstrumentType):
         # https://www.cfht.hawaii.edu/Instruments/Imaging/WIRCam/ says November 2006
         # but existing metadata has a minimum value of 2000-07-21 00:00:00 for mastertwilightflat_Ks_13Aw01_v200.fits
         self._instrument_start_date = mc.make_datetime('2000-07-20 00:00:00.000')
+        self._filter_md = None
+        self._updated_filter_name = None
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the WIRCam-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
 
         # caom2IngestWircam.py, l1063
         if self._storage_name.suffix == 'p':
@@ -3117,12 +3338,14 @@ class WircamTemporal(InstrumentType):
             self._chunk.energy_axis = None
             self._chunk.time_axis = None
 
-    def update_energy(self):
+    def update_artifact(self):
+        super().update_artifact()
+        # one FILTER value for all the extensions
         filter_name = mc.get_keyword(self._headers, 'FILTER')
-        filter_md, updated_filter_name = get_filter_md(filter_name, self._storage_name)
-        cc.build_chunk_energy_range(
-            self._chunk, updated_filter_name, filter_md
-        )
+        self._filter_md, self._updated_filter_name = get_filter_md(filter_name, self._storage_name)
+
+    def update_energy(self):
+        cc.build_chunk_energy_range(self._chunk, self._updated_filter_name, self._filter_md)
         if self._chunk.energy is not None:
             self._chunk.energy.ssysobs = 'TOPOCENT'
             self._chunk.energy.ssyssrc = 'TOPOCENT'
@@ -3160,22 +3383,22 @@ class WircamTemporal(InstrumentType):
 
 class WircamSpectralTemporal(WircamTemporal):
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the WIRCam-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         bp.configure_time_axis(3)
         self.accumulate_time_chunk_blueprint(bp)
 
 
 class Wircam(WircamSpectralTemporal):
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the WIRCam-specific ObsBlueprint at the CAOM model
         Observation level.
         """
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
         bp.configure_position_axes((1, 2))
         self.accumulate_spatial_chunk_blueprint(bp)
 
@@ -3183,7 +3406,7 @@ class Wircam(WircamSpectralTemporal):
 class WircamG(WircamTemporal):
     """suffix == 'g'"""
 
-    def accumulate_blueprint(self, bp):
+    def _accumulate_blueprint(self, bp):
         """Configure the telescope-specific ObsBlueprint at the CAOM model Observation level.
 
         This code captures the portion of the TDM->CAOM model mapping, where the relationship is one or many elements
@@ -3191,10 +3414,13 @@ class WircamG(WircamTemporal):
         generally, use add_attribute. If the mapping cardinality is n:1 use the set method to reference a function
         call. """
         self._logger.debug('Begin accumulate_blueprint.')
-        super().accumulate_blueprint(bp)
+        super()._accumulate_blueprint(bp)
+        bp.configure_time_axis(3)
+
+    def _accumulate_file_blueprint(self, bp):
+        super()._accumulate_file_blueprint(bp)
         # don't want GUIDE file Observation-level metadata
         self._use_existing_observation(bp)
-        bp.configure_time_axis(3)
 
     def get_bandpass_name(self, ext):
         wheel_a = self._headers[ext].get('WHEELADE')
@@ -3327,7 +3553,7 @@ class WircamG(WircamTemporal):
         # ZNAXIS* keyword values before trying NAXIS*, hence the header
         # lookup code
 
-        ref_coord_val = ac.to_mjd(mc.get_keyword(self._headers, 'MJD-OBS'))
+        ref_coord_val = cfht_to_mjd(mc.get_keyword(self._headers, 'MJD-OBS'))
         part_index = mc.to_int(self.part.name)
         part_header = self._headers[part_index]
 
@@ -3432,6 +3658,41 @@ class Unsupported(AuxiliaryType):
         return result
 
 
+def _scan_provenance(headers, derived_type, obs_id):
+    """Find the provenance inputs in all the headers in one pass. Master detrends repeat the same inputs across many
+    cards and HDUs, so each distinct value is repaired only once.
+
+    :param headers: astropy.io.fits.Header list
+    :param derived_type: ProvenanceType, the keyword prefix, and how to repair the keyword values
+    :param obs_id: str for logging
+    :return: set of (prov_obs_id, prov_prod_id)
+    """
+    result = set()
+    prefix = derived_type.value
+    if derived_type is ProvenanceType.COMMENT:
+        # all the COMMENT cards of a header are repaired together
+        for header in headers:
+            if prefix in header:
+                for prov_obs_id, prov_prod_id in _repair_comment_provenance_value(header.get(prefix), obs_id):
+                    if prov_obs_id is not None and prov_prod_id is not None:
+                        result.add((prov_obs_id, prov_prod_id))
+    else:
+        if derived_type is ProvenanceType.IMCMB:
+            repair = _repair_imcmb_provenance_value
+        else:
+            repair = _repair_filename_provenance_value
+        values = set()
+        for header in headers:
+            for keyword, value in header.items():
+                if keyword.startswith(prefix):
+                    values.add(value)
+        for value in values:
+            prov_obs_id, prov_prod_id = repair(value, obs_id)
+            if prov_obs_id is not None and prov_prod_id is not None:
+                result.add((prov_obs_id, prov_prod_id))
+    return result
+
+
 def _repair_comment_provenance_value(value, obs_id):
     logging.debug(f'Begin _repair_comment_provenance_value for {obs_id}')
     results = []
@@ -3467,7 +3728,7 @@ def _repair_filename_provenance_value(value, obs_id):
     # repair values that look like this:
     # FILENAME= '2401734o.fits'      / Base filename at acquisition
     temp = value.replace('.fits', '')
-    if match('[0-9]{5,7}o', temp):
+    if FILENAME_PROVENANCE.match(temp):
         prov_prod_id = temp
         prov_obs_id = temp[:-1]
     logging.debug(f'End _repair_filename_provenance_value')
@@ -3505,7 +3766,20 @@ def _repair_imcmb_provenance_value(value, obs_id):
     return prov_obs_id, prov_prod_id
 
 
+# (filter_md, updated_filter_name) by (instrument name, FILTER value), see get_filter_md
+_filter_md_memo = {}
+
+
 def get_filter_md(filter_name, storage_name):
+    key = (storage_name.instrument.value, filter_name)
+    result = _filter_md_memo.get(key)
+    if result is None:
+        result = _find_filter_md(filter_name, storage_name)
+        _filter_md_memo[key] = result
+    return result
+
+
+def _find_filter_md(filter_name, storage_name):
     filter_md = md.filter_cache.get_svo_filter(storage_name.instrument.value, filter_name)
     if not md.filter_cache.is_cached(storage_name.instrument.value, filter_name):
         # want to stop ingestion if the filter name is not expected
@@ -3518,7 +3792,7 @@ def get_filter_md(filter_name, storage_name):
     # the full filter name maybe you can hack it based on your knowledge of which i filter was used during this era.
     #
     # SGo - hence the reverse lookup of FILTER_REPAIR CACHE
-    updated_filter_name = mc.reverse_lookup(filter_name, md.cache.get_from(md.FILTER_REPAIR_CACHE))
+    updated_filter_name = md.cache.get_repaired_filter_name(filter_name)
     if updated_filter_name is None:
         updated_filter_name = filter_name
     return filter_md, updated_filter_name
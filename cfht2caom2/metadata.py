@@ -132,8 +132,16 @@ class CFHTCache(mc.Cache):
         self._project_titles = self.get_from(PROJECT_TITLES_CACHE)
         self._program_titles = self.get_from(PROGRAM_TITLES_CACHE)
         self._cached_semesters = self._fill_cached_semesters()
+        self._filter_repair_index = self._fill_filter_repair_index()
         self._logger = logging.getLogger(__name__)
 
+    def _fill_filter_repair_index(self):
+        # value => key, the first key wins, like a scan of the lookup in order
+        result = {}
+        for key, value in self.get_from(FILTER_REPAIR_CACHE).items():
+            result.setdefault(value, key)
+        return result
+
     def _fill_cached_semesters(self):
         result = []
         for key in self._project_titles.keys():
@@ -220,6 +228,10 @@ class CFHTCache(mc.Cache):
             temp = CFHTCache.clean(result)
         return temp
 
+    def get_repaired_filter_name(self, filter_name):
+        """:return: the filter_repair_lookup key for the filter_name value, or None if there is no such value."""
+        return self._filter_repair_index.get(filter_name)
+
     def get_program(self, run_id):
         result = None
         for key, value in self._program_titles.items():
@@ -245,12 +257,7 @@ class CFHTCache(mc.Cache):
 
 
 def reverse_lookup(value_to_find):
-    result = next(
-        key
-        for key, value in cache.get_from(FILTER_REPAIR_CACHE).items()
-        if value == value_to_find
-    )
-    return result
+    return cache.get_repaired_filter_name(value_to_find)
 
 
 cache = CFHTCache()
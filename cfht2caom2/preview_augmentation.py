@@ -66,28 +66,60 @@
 # ***********************************************************************
 #
 
-import aplpy
 import h5py
+import logging
 import os
+import threading
 
 import matplotlib as mpl
 import matplotlib.image as image
-import matplotlib.pyplot as plt
 import numpy as np
 
 from astropy.io import fits
 from astropy.table import Table
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
 
 from caom2 import ProductType, ReleaseType, ObservationIntentType
-from caom2pipe import astro_composable as ac
 from caom2pipe import manage_composable as mc
+from cfht2caom2 import ds9_pool
+from cfht2caom2.cfht_config import get_option
 from cfht2caom2 import metadata as md
+from cfht2caom2 import preview_render
+from cfht2caom2 import preview_source
 
 __all__ = ['visit']
 
 
+# the instruments with single-image files that the config.yml preview_renderer: numpy handles - WIRCam MEFs are
+# rendered with ds9
+NUMPY_RENDERED = [md.Inst.ESPADONS, md.Inst.SITELLE, md.Inst.SPIROU, md.Inst.WIRCAM]
+# the instruments with MEF mosaics that the numpy renderer handles
+NUMPY_MOSAICKED = [md.Inst.MEGACAM, md.Inst.MEGAPRIME]
+
+# the spectrum previews share one matplotlib Figure, so they run one at a time
+_serial_lock = threading.RLock()
+
+
+_spectrum_figure = None
+
+
+def _get_spectrum_figure():
+    """
+    :return: the one matplotlib Figure, on an Agg canvas, that spectrum previews are drawn on. It is cleared for
+        each use, instead of creating a new pyplot figure per file. Callers hold _serial_lock.
+    """
+    global _spectrum_figure
+    if _spectrum_figure is None:
+        _spectrum_figure = Figure(figsize=(10.24, 10.24), dpi=100)
+        FigureCanvasAgg(_spectrum_figure)
+    else:
+        _spectrum_figure.clf()
+    return _spectrum_figure
+
+
 class CFHTPreview(mc.PreviewVisitor):
     def __init__(self, instrument, intent, obs_type, target, **kwargs):
         super(CFHTPreview, self).__init__(**kwargs)
@@ -106,6 +138,84 @@ class CFHTPreview(mc.PreviewVisitor):
         self._target_name = (
             target.name if target is not None else self._storage_name.file_id
         )
+        # preview URI: local file name, of the previews generated by this visit
+        self._generated = {}
+        config = kwargs.get('config')
+        self._renderer = get_option(config, 'preview_renderer')
+        self._mosaic_workers = get_option(config, 'mosaic_workers')
+        self._sitelle_median_stride = get_option(config, 'sitelle_median_stride')
+        self._ds9_pool_size = get_option(config, 'ds9_pool_size')
+        self._skip_current = get_option(config, 'preview_skip_current')
+        self._preview_version = str(get_option(config, 'preview_version'))
+        self._source = None
+        clients = kwargs.get('clients')
+        self._data_client = None if clients is None else clients.data_client
+
+    def add_preview(self, uri, f_name, *args, **kwargs):
+        super().add_preview(uri, f_name, *args, **kwargs)
+        self._generated[uri] = f_name
+
+    def _source_checksum(self, observation):
+        """:return str the checksum URI of the science artifact, as recorded in the observation, or None"""
+        plane = observation.planes.get(self._storage_name.product_id)
+        if plane is None:
+            return None
+        artifact = plane.artifacts.get(self._storage_name.file_uri)
+        if artifact is None or artifact.content_checksum is None:
+            return None
+        return artifact.content_checksum.uri
+
+    def is_current(self, observation):
+        """
+        :return: True if config.yml preview_skip_current is set, and the previews at CADC were generated, with this
+            preview_version, from the science file content as it is now, and are all still artifacts of the plane,
+            so there's no need to generate them again
+        """
+        if not self._skip_current or self._data_client is None:
+            return False
+        checksum = self._source_checksum(observation)
+        plane = observation.planes.get(self._storage_name.product_id)
+        if checksum is None or plane is None:
+            return False
+        # every preview has the record, and the thumbnail is the smallest one to retrieve
+        uri = None
+        for candidate in [self._storage_name.thumb_uri, self._storage_name.prev_uri]:
+            if candidate in plane.artifacts.keys():
+                uri = candidate
+                break
+        if uri is None:
+            return False
+        fqn = os.path.join(self._working_dir, os.path.basename(uri))
+        try:
+            self._data_client.get(self._working_dir, uri)
+            source = preview_source.read(fqn)
+        except Exception as e:
+            # the record only saves time, so generate the previews rather than fail
+            self._logger.warning(f'Could not read the preview source from {uri}: {e}')
+            source = None
+        finally:
+            if os.path.exists(fqn):
+                os.unlink(fqn)
+        return (
+            source is not None
+            and source.checksum == checksum
+            and source.version == self._preview_version
+            and len(source.previews) > 0
+            and all(preview_uri in plane.artifacts.keys() for preview_uri in source.previews)
+        )
+
+    def visit(self, observation):
+        self._source = self._source_checksum(observation)
+        return super().visit(observation)
+
+    def _record_source(self):
+        """Record the science file content, and preview_version, in each of the generated previews, before they are
+        stored."""
+        if self._source is None:
+            return
+        source = preview_source.PreviewSource(self._source, self._preview_version, self._generated.keys())
+        for f_name in self._generated.values():
+            preview_source.write(os.path.join(self._working_dir, f_name), source)
 
     def generate_plots(self, obs_id):
         self._logger.debug(f'Begin generate_plots for {obs_id}')
@@ -118,19 +228,29 @@ class CFHTPreview(mc.PreviewVisitor):
             self._instrument is md.Inst.ESPADONS
             and self._storage_name.suffix in ['i', 'p']
         ):
-            count = self._do_espadons_science()
+            with _serial_lock:
+                count = self._do_espadons_science()
         elif (
             self._instrument is md.Inst.SPIROU
             and self._storage_name.suffix in ['e', 'p', 's', 't', 'v']
         ):
-            if self._storage_name.suffix == 'v':
-                count = self._do_spirou_bintable()
-            else:
-                count = self._do_spirou_intensity_spectrum()
+            with _serial_lock:
+                if self._storage_name.suffix == 'v':
+                    count = self._do_spirou_bintable()
+                else:
+                    count = self._do_spirou_intensity_spectrum()
         else:
             count = 0
             if not self._storage_name.hdf5 and not '_diag' in self._storage_name.file_name:
-                count = self._do_ds9_prev(obs_id)
+                numpy_rendered = self._renderer == 'numpy' and 'scatter' not in self._science_fqn
+                if numpy_rendered and self._instrument in NUMPY_RENDERED:
+                    count = self._do_numpy_prev(obs_id)
+                elif numpy_rendered and self._instrument in NUMPY_MOSAICKED:
+                    count = self._do_numpy_mosaic_prev(obs_id)
+                else:
+                    count = self._do_ds9_prev(obs_id)
+        if self._skip_current and count > 0:
+            self._record_source()
         self._logger.debug('End generate_plots')
         return count
 
@@ -144,57 +264,42 @@ class CFHTPreview(mc.PreviewVisitor):
         # Polarization scale factor
         pScale = 5.0
 
-        self._hdu_list = fits.open(self._science_fqn)
-        self._ext = 0
-        try:
-            ignore = self._hdu_list[self._ext].header.get('OBJECT')
-        except LookupError:
-            self._ext = 1
-            ignore = self._hdu_list[self._ext].header.get('OBJECT')
-
-        hdr = self._hdu_list[self._ext].header.copy()
-        bzero = hdr.get('BZERO')
-        bscale = hdr.get('BSCALE')
-
-        if bzero is not None and bzero > 0.0:
-            data_0 = self._hdu_list[self._ext].data[0].copy()
-            data_1 = self._hdu_list[self._ext].data[1].copy()
-            # wavelength array (nm)
-            sw = bscale * data_0 - bzero
-            # intensity array (normalized)
-            si = bscale * data_1 - bzero
-            if self._storage_name.suffix == 'p':
-                # Stokes array
-                data_2 = self._hdu_list[self._ext].data[2].copy()
-                sp = bscale * data_2 - bzero
-        else:
-            sw = self._hdu_list[self._ext].data[0].copy()  # wavelength array (nm)
-            si = self._hdu_list[self._ext].data[1].copy()  # intensity array (normalized)
-            if self._storage_name.suffix == 'p':
-                sp = self._hdu_list[self._ext].data[2].copy()  # Stokes array
-
-        self._logger.debug(f'{sw.shape} {sw}, {si}')
-        npix = sw.shape[0]
-
-        swa = 10.0 * sw
-        sia = np.arange(0.0, npix, 1.0)
-        spa = None
-        if self._storage_name.suffix == 'p':
-            spa = np.arange(0.0, npix, 1.0)
-
-        # determine upper/lower y limits for two planes from intensity values
-        for i in range(sia.shape[0]):
-            sia[i] = float(si[i])
-            if self._storage_name.suffix == 'p':
-                spa[i] = (
-                    float(sp[i]) * pScale
-                )  # increase scale of polarization
-
-        fig = plt.figure(figsize=(10.24, 10.24), dpi=100)
+        with fits.open(self._science_fqn) as hdu_list:
+            self._ext = 0
+            try:
+                ignore = hdu_list[self._ext].header.get('OBJECT')
+            except LookupError:
+                self._ext = 1
+                ignore = hdu_list[self._ext].header.get('OBJECT')
+
+            hdr = hdu_list[self._ext].header
+            bzero = hdr.get('BZERO')
+            bscale = hdr.get('BSCALE')
+            data = hdu_list[self._ext].data
+            # wavelength array (nm), intensity array (normalized), Stokes array
+            sw = data[0]
+            si = data[1]
+            sp = data[2] if self._storage_name.suffix == 'p' else None
+            if bzero is not None and bzero > 0.0:
+                sw = bscale * sw - bzero
+                si = bscale * si - bzero
+                if sp is not None:
+                    sp = bscale * sp - bzero
+
+            self._logger.debug(f'{sw.shape} {sw}, {si}')
+            swa = 10.0 * sw
+            sia = np.array(si, dtype=np.float64)
+            spa = None
+            if sp is not None:
+                # increase scale of polarization
+                spa = np.array(sp, dtype=np.float64) * pScale
+            del data
+
+        fig = _get_spectrum_figure()
         count = 0
         if self._subplot(fig, swa, sia, spa, 4300.0, 4600.0, 1, 4408.0, 4412.0, 'Stokes spectrum (x5)'):
             if self._subplot(fig, swa, sia, spa, 6500.0, 6750.0, 2, 6589.0, 6593.0, 'Stokes spectrum (x5)'):
-                plt.savefig(self._preview_fqn, format='jpg')
+                fig.savefig(self._preview_fqn, format='jpg')
                 self.add_preview(
                     self._storage_name.prev_uri, self._storage_name.prev, ProductType.PREVIEW, ReleaseType.DATA
                 )
@@ -206,6 +311,7 @@ class CFHTPreview(mc.PreviewVisitor):
                         self._storage_name.thumb_uri, self._storage_name.thumb, ProductType.THUMBNAIL, ReleaseType.META
                     )
                     self.add_to_delete(self._thumb_fqn)
+        fig.clf()
         return count
 
     def _subplot(
@@ -222,13 +328,16 @@ class CFHTPreview(mc.PreviewVisitor):
         text_3,
     ):
         label = f'{self._storage_name.product_id}: {self._target_name}'
-        wl = swa[(swa > wl_low) & (swa < wl_high)]
-        flux = sia[(swa > wl_low) & (swa < wl_high)]
-        wl_sort = wl[wl.argsort()]
-        flux_sort = flux[wl.argsort()]
+        # one mask and one sort per window
+        window = (swa > wl_low) & (swa < wl_high)
+        wl = swa[window]
+        order = wl.argsort()
+        wl_sort = wl[order]
+        flux = sia[window]
+        flux_sort = flux[order]
         if self._storage_name.suffix == 'p':
-            pflux = spa[(swa > wl_low) & (swa < wl_high)]
-            pflux_sort = pflux[wl.argsort()]
+            pflux = spa[window]
+            pflux_sort = pflux[order]
             flux = np.append(flux, pflux)
         result = False
         if flux.shape == (0,):
@@ -347,27 +456,25 @@ class CFHTPreview(mc.PreviewVisitor):
             f'Do ds9 preview augmentation with {self._science_fqn}'
         )
         count = 0
-        delete_list = []
-        content = ac.read_fits_data(self._science_fqn)
-        headers = [h.header for h in content]
+        with fits.open(self._science_fqn, memmap=True) as hdu_list:
+            # only the headers are read
+            headers = [h.header for h in hdu_list]
         # SF - 26-02-21
         # use the size of the HDUList
-        num_extensions = len(content)
+        num_extensions = len(headers)
 
         zoom_science_fqn = self._science_fqn
 
         # from genWirprevperplane.py
         # if it's a datacube, just take the first slice
         # e.g. fitscopy '928690p.fits[*][*,*,1:1]' s1928690p.fits
+        # ds9 displays the first slice of a cube, so the thumbnail and preview are generated from the file as is
 
-        # set up the correct input file - may need to use fitscopy
+        # set up the correct input file - may need the first slice of the zoom HDU
         rotate_param = ''
         scale_param = 'zscale'
         if self._instrument is md.Inst.WIRCAM:
-            if self._science_fqn.endswith('.fz'):
-                naxis_3 = headers[0].get('ZNAXIS3', 1)
-            else:
-                naxis_3 = headers[0].get('NAXIS3', 1)
+            naxis_3 = headers[0].get('ZNAXIS3', headers[0].get('NAXIS3', 1))
 
             # SF - 08-04-20 - for 'g' use fitscopy, then regular ds9 for zoom
             # calibration. This is a change from guidance of 19-03-20, which
@@ -377,45 +484,16 @@ class CFHTPreview(mc.PreviewVisitor):
                     f'Observation {obs_id}: using first slice of '
                     f'{self._science_fqn}.'
                 )
-                # TODO - fix this
-                if self._storage_name.file_name.endswith('.fz'):
-                    temp_science_f_name = (
-                        self._storage_name.file_name.replace(
-                            '.fz', '_slice.fz'
-                        )
-                    )
-                else:
-                    temp_science_f_name = (
-                        self._storage_name.file_name.replace(
-                            '.fits', '_slice.fits'
-                        )
-                    )
-
-                slice_cmd = (
-                    f'fitscopy {self._science_fqn}[*][*,*,1:1,1:1] '
-                    f'{temp_science_f_name}'
-                )
-                self._exec_cmd_chdir(temp_science_f_name, slice_cmd)
-                science_fqn = f'{self._working_dir}/{temp_science_f_name}'
-                delete_list.append(science_fqn)
 
             if num_extensions >= 4:
                 self._logger.info(
                     f'Observation {obs_id}: using slice for zoom preview of '
                     f'{self._science_fqn}.'
                 )
-                zoom_science_f_name = self._storage_name.file_name.replace(
-                    '.fits', '_zoom.fits'
-                )
-                slice_cmd = (
-                    f'fitscopy {self._science_fqn}[4][*,*,1:1] '
-                    f'{zoom_science_f_name}'
-                )
-                self._exec_cmd_chdir(zoom_science_f_name, slice_cmd)
-                zoom_science_fqn = (
-                    f'{self._working_dir}/{zoom_science_f_name}'
-                )
-                delete_list.append(zoom_science_fqn)
+                # the equivalent of fitscopy [4][*,*,1:1], in-process
+                zoom_science_fqn = os.path.join(self._working_dir, f'{self._storage_name.file_id}_zoom.fits')
+                self._write_first_plane(4, zoom_science_fqn)
+                self.add_to_delete(zoom_science_fqn)
 
         elif self._instrument in [md.Inst.MEGACAM, md.Inst.MEGAPRIME]:
             rotate_param = '-rotate 180'
@@ -458,7 +536,7 @@ class CFHTPreview(mc.PreviewVisitor):
 
         geometry = '256x521'
 
-        count += CFHTPreview._gen_image(
+        count += self._gen_image(
             self._science_fqn,
             geometry,
             self._thumb_fqn,
@@ -479,7 +557,7 @@ class CFHTPreview(mc.PreviewVisitor):
 
         geometry = '1024x1024'
         if self._instrument in [md.Inst.MEGACAM, md.Inst.MEGAPRIME]:
-            count += CFHTPreview._gen_image(
+            count += self._gen_image(
                 self._science_fqn,
                 geometry,
                 self._preview_fqn,
@@ -490,7 +568,7 @@ class CFHTPreview(mc.PreviewVisitor):
                 scale_param=scale_param,
             )
         else:
-            count += CFHTPreview._gen_image(
+            count += self._gen_image(
                 self._science_fqn,
                 geometry,
                 self._preview_fqn,
@@ -537,7 +615,7 @@ class CFHTPreview(mc.PreviewVisitor):
             zoom_science_fqn = ''
         elif self._instrument is md.Inst.SITELLE:
             pan_param = '-pan -512 1544'
-        count += CFHTPreview._gen_image(
+        count += self._gen_image(
             zoom_science_fqn,
             geometry,
             self._zoom_fqn,
@@ -560,12 +638,122 @@ class CFHTPreview(mc.PreviewVisitor):
                 self.add_to_delete(self._zoom_fqn)
         return count
 
+    def _do_numpy_prev(self, obs_id):
+        """
+        Render the thumbnail, preview and zoom in-process, for files with a single image, with the ds9 settings of
+        _do_ds9_prev. The data is read once, and each JPEG is encoded once.
+        """
+        self._logger.debug(f'Do numpy preview augmentation with {self._science_fqn}')
+        with fits.open(self._science_fqn, memmap=True) as hdu_list:
+            num_extensions = len(hdu_list)
+            mosaic = self._instrument is md.Inst.WIRCAM and preview_render.image_count(hdu_list) > 1
+            data = None if mosaic else preview_render.image_data(hdu_list)
+        if mosaic:
+            return self._do_ds9_prev(obs_id)
+        if data is None:
+            self._logger.warning(f'No image data in {self._science_fqn}. No previews.')
+            return 0
+
+        # the scope is global, because there is only one image
+        low, high = preview_render.scale_limits(data, self._scale_mode())
+
+        factor = preview_render.reduction_factor(data.shape, preview_render.PREVIEW_SIZE)
+        pixels = preview_render.stretch(preview_render.block_average(data, factor), low, high)
+        thumb = preview_render.fit(pixels, preview_render.THUMBNAIL_SIZE)
+        preview = preview_render.fit(pixels, preview_render.PREVIEW_SIZE)
+
+        zoom = None
+        pan = (0.0, 0.0)
+        if self._instrument is md.Inst.WIRCAM:
+            pan = (484.0, -484.0)
+            if self._storage_name.suffix == 'g':
+                zoom = preview
+        elif self._instrument is md.Inst.SITELLE:
+            pan = (-512.0, 1544.0)
+        if zoom is None:
+            zoom = preview_render.pan(data, preview_render.PREVIEW_SIZE, *pan)
+            zoom = Image.fromarray(preview_render.stretch(zoom, low, high)).convert('RGB')
+        return self._save_numpy_previews(num_extensions, thumb, preview, zoom)
+
+    def _do_numpy_mosaic_prev(self, obs_id):
+        """
+        Render MegaPrime MEF previews in-process, with the ds9 settings of _do_ds9_prev. The thumbnail and preview
+        are one mosaic of the CCDs, placed by DETSEC, as with -mosaicimage iraf. The zoom is one CCD.
+        """
+        self._logger.debug(f'Do numpy mosaic preview augmentation with {self._science_fqn}')
+        with fits.open(self._science_fqn, memmap=True) as hdu_list:
+            num_extensions = len(hdu_list)
+            image_count = preview_render.image_count(hdu_list)
+        scale_mode = self._scale_mode()
+        scope = 'global' if self._intent is ObservationIntentType.SCIENCE else 'local'
+        result = None
+        if image_count > 1:
+            result = preview_render.mosaic(
+                self._science_fqn, preview_render.PREVIEW_SIZE, scale_mode, scope, self._mosaic_workers
+            )
+        if result is None:
+            self._logger.info(f'{self._science_fqn} is not a DETSEC mosaic. Using ds9.')
+            return self._do_ds9_prev(obs_id)
+
+        canvas, low, high = result
+        pixels = preview_render.stretch(canvas, low, high, rotate=True)
+        thumb = preview_render.fit(pixels, preview_render.THUMBNAIL_SIZE)
+        preview = preview_render.fit(pixels, preview_render.PREVIEW_SIZE)
+        del canvas
+
+        # the zoom is CCD 23, or 14, or 1, depending on how many there are, and only CCD 23 is not rotated
+        rotate = True
+        if num_extensions >= 23:
+            zoom_index = 23
+            rotate = False
+        elif num_extensions >= 14:
+            zoom_index = 14
+        else:
+            zoom_index = 1
+        with fits.open(self._science_fqn, memmap=True) as hdu_list:
+            data = preview_render.image_data(hdu_list, zoom_index)
+        zoom = None
+        if data is None:
+            self._logger.warning(f'No image data in HDU {zoom_index} of {self._science_fqn}. No zoom.')
+        else:
+            # the -fits [n] zoom has a global scope over the one CCD
+            low, high = preview_render.scale_limits(data, scale_mode)
+            zoom = preview_render.pan(data, preview_render.PREVIEW_SIZE, -9.0, 1780.0)
+            zoom = Image.fromarray(preview_render.stretch(zoom, low, high, rotate)).convert('RGB')
+        return self._save_numpy_previews(num_extensions, thumb, preview, zoom)
+
+    def _scale_mode(self):
+        # SF - 08-04-20 - change to minmax for 'm' files instead of zscale
+        # 'm' is equivalent to 'MASK'
+        if self._storage_name.suffix == 'm' or self._obs_type == 'MASK':
+            return 'minmax'
+        return 'zscale'
+
+    def _save_numpy_previews(self, num_extensions, thumb, preview, zoom):
+        self._draw_title(num_extensions, thumb, 8)
+        thumb.save(self._thumb_fqn, format='JPEG')
+        self.add_preview(
+            self._storage_name.thumb_uri, self._storage_name.thumb, ProductType.THUMBNAIL, ReleaseType.META
+        )
+        self.add_to_delete(self._thumb_fqn)
+        self._draw_title(num_extensions, preview, offset=2)
+        preview.save(self._preview_fqn, format='JPEG')
+        self.add_preview(self._storage_name.prev_uri, self._storage_name.prev, ProductType.PREVIEW, ReleaseType.DATA)
+        self.add_to_delete(self._preview_fqn)
+        if zoom is None:
+            return 2
+        zoom.save(self._zoom_fqn, format='JPEG')
+        self.add_preview(self._storage_name.zoom_uri, self._storage_name.zoom, ProductType.PREVIEW, ReleaseType.DATA)
+        self.add_to_delete(self._zoom_fqn)
+        return 3
+
     def _do_spirou_bintable(self):
         label = f'{self._storage_name.product_id}: {self._target_name}'
         self._logger.debug(f'Generating {label} plot')
 
         df = Table.read(self._science_fqn)
-        plt.figure(figsize=(10.24, 10.24), dpi=100)
+        fig = _get_spectrum_figure()
+        axis = fig.add_subplot(1, 1, 1)
         found = False
         # From Chris Usher at CFHT - 18-10-23 - the change from 'Velocity' to 'RV' would have happened as part of the
         # APERO (SPIRou DRS) version update, where the final products for processed data moved from something
@@ -574,7 +762,7 @@ class CFHTPreview(mc.PreviewVisitor):
         for x_name in ['Velocity', 'RV']:
             for y_name in ['Combined', 'CCF_STACK']:
                 try:
-                    plt.plot(df[x_name], df[y_name])
+                    axis.plot(df[x_name], df[y_name])
                     found = True
                     break
                 except KeyError:
@@ -583,79 +771,67 @@ class CFHTPreview(mc.PreviewVisitor):
             self._logger.debug(df.info())
             raise mc.CadcException('Unexpected column names.')
 
-        plt.title(label, weight='bold', color='m')
-        plt.xlabel('Radial Velocity (km/s)')
-        plt.ylabel('Weighted mean echelle order')
-        plt.savefig(self._preview_fqn, format='jpg')
-        plt.close()
+        axis.set_title(label, weight='bold', color='m')
+        axis.set_xlabel('Radial Velocity (km/s)')
+        axis.set_ylabel('Weighted mean echelle order')
+        fig.savefig(self._preview_fqn, format='jpg')
+        fig.clf()
         return self._save_figure()
 
     def _do_spirou_intensity_spectrum(self):
         self._logger.debug('Begin _do_spirou_intensity_spectrum')
-        self._hdu_list = fits.open(self._science_fqn)
         self._ext = 0
+        sp = None
+        with fits.open(self._science_fqn) as hdu_list:
+            if self._storage_name.suffix in ['e', 't']:
+                sw = np.ravel(hdu_list['WaveAB'].data)  # wavelength array (nm)
+                si = np.ravel(hdu_list['FluxAB'].data)  # intensity array (normalized)
 
-        # Polarization scale factor
-
-        if self._storage_name.suffix in ['e', 't']:
-            sw2d = self._hdu_list['WaveAB'].data.copy()  # wavelength array (nm)
-            si2d = self._hdu_list['FluxAB'].data.copy()  # intensity array (normalized)
-            del self._hdu_list['WaveAB'].data
-            del self._hdu_list['FluxAB'].data
-            sw = np.ravel(sw2d)
-            si = np.ravel(si2d)
-
-        if self._storage_name.suffix == 'p':
-            sw2d = self._hdu_list['WaveAB'].data.copy()  # wavelength array (nm)
-            si2d = self._hdu_list['StokesI'].data.copy()  # intensity array (normalized)
-            sp2d = self._hdu_list['Pol'].data.copy()  # Pol Stokes array
-            del self._hdu_list['WaveAB'].data
-            del self._hdu_list['StokesI'].data
-            del self._hdu_list['Pol'].data
-            sw = np.ravel(sw2d)
-            si = np.ravel(si2d)
-            sp = np.ravel(sp2d)
-            pScale = 5.0 * max(si)
-
-        if self._storage_name.suffix == 's':
-            # using uniform wavelength bins
-            self._ext = 1
-            sw = self._hdu_list[self._ext].data.copy().field(0)
-            si = self._hdu_list[self._ext].data.copy().field(1)
-
-        npix = sw.shape[0]
-        swa = 10.0 * sw
-        sia = np.arange(0.0, npix, 1.0)
-        spa = None
-        if self._storage_name.suffix == 'p':
-            spa = np.arange(0.0, npix, 1.0)
-        # determine upper/lower y limits for two planes from intensity values
-        for i in range(sia.shape[0]):
-            sia[i] = float(si[i])
             if self._storage_name.suffix == 'p':
-                spa[i] = float(sp[i]) * pScale  # increase polarization scale
-        fig = plt.figure(figsize=(10.24, 10.24), dpi=100)
+                sw = np.ravel(hdu_list['WaveAB'].data)  # wavelength array (nm)
+                si = np.ravel(hdu_list['StokesI'].data)  # intensity array (normalized)
+                sp = np.ravel(hdu_list['Pol'].data)  # Pol Stokes array
+
+            if self._storage_name.suffix == 's':
+                # using uniform wavelength bins
+                self._ext = 1
+                sw = hdu_list[self._ext].data.field(0)
+                si = hdu_list[self._ext].data.field(1)
+
+            swa = 10.0 * sw
+            sia = np.array(si, dtype=np.float64)
+            spa = None
+            if sp is not None:
+                # Polarization scale factor - the builtin max over the intensity array, which is NaN if the first
+                # value is NaN, and otherwise ignores NaNs
+                p_scale = np.nan if np.isnan(si[0]) else np.nanmax(si)
+                # increase polarization scale
+                spa = np.array(sp, dtype=np.float64) * (5.0 * p_scale)
+
+        fig = _get_spectrum_figure()
         result = 0
         if self._subplot(fig, swa, sia, spa, 15000.0, 15110.0, 1, 15030.0, 15030.0, 'Stokes spectrum'):
             if self._subplot(fig, swa, sia, spa, 22940.0, 23130.0, 2, 22990.0, 22990.0, 'Stokes spectrum'):
-                plt.tight_layout()
-                plt.savefig(self._preview_fqn, format='jpg')
-                plt.close()
+                fig.tight_layout()
+                fig.savefig(self._preview_fqn, format='jpg')
                 result = self._save_figure()
+        fig.clf()
         return result
 
-    def _exec_cmd_chdir(self, temp_file, cmd):
-        orig_dir = os.getcwd()
-        try:
-            os.chdir(self._working_dir)
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
-            mc.exec_cmd(cmd)
-        finally:
-            os.chdir(orig_dir)
+    def _write_first_plane(self, index, fqn):
+        """Write the first plane of HDU index to fqn, reading only that plane from the science file."""
+        # the section interface seeks to, and reads, only the requested pixels, so a memory map is not required, and
+        # not memory mapping allows for the BZERO of unsigned WIRCam pixels
+        with fits.open(self._science_fqn, memmap=False) as hdu_list:
+            hdu = hdu_list[index]
+            header = hdu.header.copy()
+            for keyword in ['BSCALE', 'BZERO']:
+                # the section interface returns scaled values
+                header.remove(keyword, ignore_missing=True)
+            fits.PrimaryHDU(preview_render.first_plane(hdu), header).writeto(fqn, overwrite=True)
 
-    @staticmethod
     def _gen_image(
+        self,
         in_science_fqn,
         geometry,
         save_fqn,
@@ -667,6 +843,19 @@ class CFHTPreview(mc.PreviewVisitor):
         mode_param='-mode none',
         scale_param='',
     ):
+        if self._ds9_pool_size > 0:
+            return ds9_pool.get_pool(self._ds9_pool_size).gen_image(
+                in_science_fqn,
+                geometry,
+                save_fqn,
+                scope_param,
+                rotate_param,
+                zoom_param,
+                pan_param,
+                mosaic_param,
+                mode_param,
+                scale_param,
+            )
         # 20-03-20 - seb - always use iraf - do not trust wcs coming from the
         # data acquisition. A proper one needs processing which is often not
         # done on observations.
@@ -693,10 +882,16 @@ class CFHTPreview(mc.PreviewVisitor):
         return count
 
     def _add_title(self, num_extensions, in_fqn, font_size=16, offset=0):
-        if (
-            self._instrument in [md.Inst.MEGACAM, md.Inst.MEGAPRIME]
-            and num_extensions < 36
-        ):
+        if self._needs_title(num_extensions):
+            image = Image.open(in_fqn)
+            self._draw_title(num_extensions, image, font_size, offset)
+            image.save(in_fqn)
+
+    def _needs_title(self, num_extensions):
+        return self._instrument in [md.Inst.MEGACAM, md.Inst.MEGAPRIME] and num_extensions < 36
+
+    def _draw_title(self, num_extensions, image, font_size=16, offset=0):
+        if self._needs_title(num_extensions):
             # SF 02-26-21
             # add an option to the ds9 command: -grid title text {this file
             # has only XX HDUs}`, only for MegaPrime files below a threshold
@@ -706,7 +901,6 @@ class CFHTPreview(mc.PreviewVisitor):
                 f'{self._storage_name.file_name} has only '
                 f'{num_extensions} HDUs'
             )
-            image = Image.open(in_fqn)
             width, height = image.size
             draw = ImageDraw.Draw(image)
             fpath = Path(mpl.get_data_path(), 'fonts/ttf/DejaVuSans-Bold.ttf')
@@ -719,7 +913,6 @@ class CFHTPreview(mc.PreviewVisitor):
             y = text_height + margin
             # text is black
             draw.text((x, y), title, (0, 0, 0), font=font)
-            image.save(in_fqn)
 
     @staticmethod
     def _gen_square(f_name):
@@ -762,154 +955,23 @@ class CFHTPreview(mc.PreviewVisitor):
             f'{self._science_fqn}'
         )
         # from genSiteprevperplane.py
-        self._hdu_list = fits.open(self._science_fqn)
-        self._ext = 0
-
         # Make a RGB colour image if it's a calibrated 3D cube
         # scan through cube to look for strongest lines
-        data = self._hdu_list[self._ext].data.copy()
-        head = self._hdu_list[self._ext].header
-        self._logger.debug(f'{data.shape}, {data.size}')
-
-        # trim off ends to make 2048x2048
-        data = data[:, 8:2056]
-
-        # trim off 30% of spectral edges - might be noisy
-        nspecaxis = data.shape[0]
-        numedgechannels = int(0.15 * nspecaxis)
-        self._logger.debug(f'{numedgechannels}')
-
-        data[:numedgechannels, :, :] = 0.0
-        data[(-1 * numedgechannels) :, :, :] = 0.0
-        nspecaxis = data.shape[0]
-        nspataxis = data.shape[1] * data.shape[2]
-        self._logger.debug(
-            f'{nspecaxis}, {nspataxis}, {data.size}, {data.shape}'
-        )
-        data2d = np.reshape(data, (nspecaxis, -1))
-        self._logger.debug(f'{data2d.shape}')
-
-        for k in range(nspecaxis):
-            medianvswavenumber = np.median(data2d[k, :])
-            data2d[k, :] = data2d[k, :] - medianvswavenumber
-        meanbgsubvswavenumber = np.mean(data2d, axis=1)
-
-        self._logger.debug(
-            f'{meanbgsubvswavenumber}, {meanbgsubvswavenumber.shape}'
-        )
-        indexmax1 = np.nanargmax(meanbgsubvswavenumber)
-        self._logger.debug(f'{indexmax1}, {meanbgsubvswavenumber[indexmax1]}')
-
-        # remove 7 channels around strongest line
-        indexmax1lo = indexmax1 - 3
-        indexmax1hi = indexmax1 + 3
-        meanbgsubvswavenumber[indexmax1lo:indexmax1hi] = 0.0
-        indexmax2 = np.nanargmax(meanbgsubvswavenumber)
-        self._logger.debug(f'{indexmax2}, {meanbgsubvswavenumber[indexmax2]}')
-
-        # remove 7 channels around second strongest line
-        indexmax2lo = indexmax2 - 3
-        indexmax2hi = indexmax2 + 3
-        meanbgsubvswavenumber[indexmax2lo:indexmax2hi] = 0.0
-        indexmax1loline = indexmax1 - 1
-        indexmax1hiline = indexmax1 + 1
-        indexmax2loline = indexmax2 - 1
-        indexmax2hiline = indexmax2 + 1
-        self._logger.debug(
-            f'{indexmax1loline}, {indexmax1hiline}, {indexmax2loline}, '
-            f'{indexmax2hiline}'
-        )
-        self._logger.debug(f'{meanbgsubvswavenumber}')
-
-        w = np.where(meanbgsubvswavenumber > 0.0)
-        self._logger.debug(f'{w[0]}')
-
-        head['NAXIS1'] = 1024
-        head['NAXIS2'] = 1024
-
-        head256 = head
-        head256['NAXIS1'] = 256
-        head256['NAXIS2'] = 256
-
-        # Make two line images in 3 different sizes
-        dataline1 = data[indexmax1loline:indexmax1hiline, :, :]
-        data2dline1 = np.mean(dataline1, axis=0)
-        self._logger.debug(f'{data2dline1.shape}')
-
-        dataline2 = data[indexmax2loline:indexmax2hiline, :, :]
-        data2dline2 = np.mean(dataline2, axis=0)
-        self._logger.debug(f'{data2dline2.shape}')
-
-        # Make "continuum" image with two strongest lines removed in 3
-        # different sizes and add this to line image so whole image not green
-        datanolines = data[w[0], :, :]
-        data2dcont = np.mean(datanolines, axis=0)
-
-        data2dline1pluscont = data2dline1 + data2dcont
-        data2dline2pluscont = data2dline2 + data2dcont
-        self._logger.debug(
-            f'{np.mean(data2dline1)}, '
-            f'{np.mean(data2dline1pluscont)}, '
-            f'{np.mean(data2dline2pluscont)}, '
-            f'{np.mean(data2dcont)}'
-        )
-
-        self._create_rgb_inputs(
-            data2dline1pluscont,
-            head,
-            head256,
-            'imageline1size1024.fits',
-            'imageline1size256.fits',
-            'imageline1zoom1024.fits',
-        )
-        self._create_rgb_inputs(
-            data2dline2pluscont,
-            head,
-            head256,
-            'imageline2size1024.fits',
-            'imageline2size256.fits',
-            'imageline2zoom1024.fits',
-        )
-        self._create_rgb_inputs(
-            data2dcont,
-            head,
-            head256,
-            'imagecontsize1024.fits',
-            'imagecontsize256.fits',
-            'imagecontzoom1024.fits',
-        )
-
-        os.system("pwd")
-        del data
-        del datanolines
+        self._ext = 0
+        with fits.open(self._science_fqn, memmap=True) as hdu_list:
+            self._logger.debug(f'{hdu_list[self._ext].shape}')
+            line1, line2, continuum = preview_render.reduce_sitelle_cube(
+                hdu_list[self._ext], median_stride=self._sitelle_median_stride
+            )
 
-        self._create_rgb(
-            'imageline1size1024.fits',
-            'imageline2size1024.fits',
-            'imagecontsize1024.fits',
-            self._preview_fqn,
-        )
-        self._create_rgb(
-            'imageline1size256.fits',
-            'imageline2size256.fits',
-            'imagecontsize256.fits',
-            self._thumb_fqn,
-        )
-        self._create_rgb(
-            'imageline1zoom1024.fits',
-            'imageline2zoom1024.fits',
-            'imagecontzoom1024.fits',
-            self._zoom_fqn,
-        )
-        self.add_to_delete('./imageline1size1024.fits')
-        self.add_to_delete('./imageline1size256.fits')
-        self.add_to_delete('./imageline1zoom1024.fits')
-        self.add_to_delete('./imageline2size1024.fits')
-        self.add_to_delete('./imageline2size256.fits')
-        self.add_to_delete('./imageline2zoom1024.fits')
-        self.add_to_delete('./imagecontsize1024.fits')
-        self.add_to_delete('./imagecontsize256.fits')
-        self.add_to_delete('./imagecontzoom1024.fits')
+        # Make two line images, and a "continuum" image, in 3 different sizes, and compose them as RGB, with the
+        # line images as red and green
+        for fqn, shape in [(self._preview_fqn, (1024, 1024)), (self._thumb_fqn, (256, 256))]:
+            preview_render.rgb(
+                self._rebin_factor(line1, shape), self._rebin_factor(line2, shape), self._rebin_factor(continuum, shape)
+            ).save(fqn, format='JPEG')
+        zoom = (slice(512, 1536), slice(512, 1536))
+        preview_render.rgb(line1[zoom], line2[zoom], continuum[zoom]).save(self._zoom_fqn, format='JPEG')
         self.add_preview(
             self._storage_name.thumb_uri,
             self._storage_name.thumb,
@@ -935,51 +997,16 @@ class CFHTPreview(mc.PreviewVisitor):
 
     def _sitelle_hdf5(self):
         self._logger.debug(f'Do sitelle hdf5 preview augmentation with {self._science_fqn}')
-        # Laurie Rousseau-Nepton - 11-08-22
         with h5py.File(self._science_fqn, 'r') as f:
-            dataset = f.get('deep_frame')
-            plt.figure(figsize=(10.24, 10.24), dpi=200)
-            plt.axis('off')
-            plt.imshow(np.log10(dataset), vmin=4.5, vmax=5.5)
-            plt.savefig(self._preview_fqn, bbox_inches='tight', format='jpg')
+            # reduce to the preview size while reading, so the full resolution frame is never in memory
+            data = preview_render.reduce_dataset(f.get('deep_frame'), preview_render.PREVIEW_SIZE)
+        # Laurie Rousseau-Nepton - 11-08-22
+        # log10 scale, from 4.5 to 5.5
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data = np.log10(data)
+        preview_render.colour_map(data, 4.5, 5.5).save(self._preview_fqn, format='JPEG')
         return self._save_figure()
 
-    def _create_rgb_inputs(
-        self,
-        input_data,
-        head,
-        head256,
-        preview_f_name,
-        thumb_f_name,
-        zoom_f_name,
-    ):
-        size1024 = self._rebin_factor(input_data, (1024, 1024))
-        size256 = self._rebin_factor(input_data, (256, 256))
-        zoom1024 = input_data[512:1536, 512:1536]
-        self._logger.debug(
-            f'{size1024.shape}, {size256.shape}, {zoom1024.shape}'
-        )
-        fits.writeto(preview_f_name, size1024, head, overwrite=True)
-        fits.writeto(thumb_f_name, size256, head256, overwrite=True)
-        fits.writeto(zoom_f_name, zoom1024, head, overwrite=True)
-
-    @staticmethod
-    def _create_rgb(line1_f_name, line2_f_name, cont_f_name, fqn):
-        aplpy.make_rgb_image(
-            [line1_f_name, line2_f_name, cont_f_name],
-            fqn,
-            stretch_r='linear',
-            stretch_g='linear',
-            stretch_b='linear',
-            pmax_r=99.5,
-            pmax_g=99.5,
-            pmax_b=99.5,
-            pmin_r=50.0,
-            pmin_g=95.0,
-            pmin_b=50.0,
-            embed_avm_tags=False,
-        )
-
     def _rebin_factor(self, a, new_shape):
         """
         Re-bin an array to a new shape.
@@ -1031,6 +1058,13 @@ def visit(observation, **kwargs):
     # No previews for 'frpts' files.
     if '.frpts.' in previewer.storage_name.file_name:
         result = observation
+    elif previewer.is_current(observation):
+        logging.info(
+            f'Previews for {previewer.storage_name.file_uri} are current. No preview augmentation for '
+            f'{observation.observation_id}.'
+        )
+        result = observation
     else:
         result = previewer.visit(observation)
     return result
+
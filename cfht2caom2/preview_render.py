@@ -0,0 +1,535 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+
+
+"""
+In-process rendering of FITS image data as JPEG previews, without ds9 or an X server.
+
+The rendering follows the ds9 settings documented in CFHTPreview._do_ds9_prev:
+- zscale or minmax scale limits, calculated over the DATASEC region (-scale datasec yes)
+- squared stretch (-scale squared)
+- inverted grey scale (-invert), on a white background
+- rotation by 180 degrees (-rotate 180)
+- zoom to fit, or zoom 1 with a pan offset from the centre of the image (-zoom 1 -pan dx dy)
+- MEF mosaics placed by DETSEC (-mosaicimage iraf), with local or global scale scope
+
+It also reduces SITELLE calibrated cubes to line and continuum images, a few spectral channels at a time, and
+composes those images as RGB previews, the way aplpy.make_rgb_image does, and reduces SITELLE HDF5 deep frames to
+colour-mapped previews, the way matplotlib imshow does.
+
+Images are arrays of uint8, with the first FITS row at the bottom, as ds9 displays them.
+"""
+
+import matplotlib
+import numpy as np
+
+from astropy.io import fits
+from astropy.visualization import AsymmetricPercentileInterval, ZScaleInterval
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+__all__ = [
+    'block_average',
+    'colour_map',
+    'fit',
+    'first_plane',
+    'image_count',
+    'image_data',
+    'mosaic',
+    'pan',
+    'parse_section',
+    'reduce_dataset',
+    'reduce_sitelle_cube',
+    'reduction_factor',
+    'rgb',
+    'scale_limits',
+    'stretch',
+    'THUMBNAIL_SIZE',
+    'PREVIEW_SIZE',
+]
+
+
+THUMBNAIL_SIZE = 256
+PREVIEW_SIZE = 1024
+
+# the ds9 frame background is white, and NaNs are displayed in the background colour
+BACKGROUND = 255
+
+# the ds9 zscale defaults
+_ZSCALE = ZScaleInterval(n_samples=600, contrast=0.25)
+
+
+def parse_section(value):
+    """
+    :param value: str a FITS section, like DATASEC or DETSEC, as '[x1:x2,y1:y2]', with 1-based inclusive pixel indices
+    :return: (x1, x2, y1, y2) as 1-based ints, or None if the value cannot be understood
+    """
+    if value is None:
+        return None
+    try:
+        x_range, y_range = value.strip().strip('[]').split(',')
+        x1, x2 = (int(ii) for ii in x_range.split(':'))
+        y1, y2 = (int(ii) for ii in y_range.split(':'))
+    except ValueError:
+        return None
+    return x1, x2, y1, y2
+
+
+def _has_image(hdu):
+    return hdu.is_image and hdu.header.get('NAXIS', 0) >= 2
+
+
+def image_data(hdu_list, index=None):
+    """
+    Read the pixels to display from one HDU.
+
+    :param hdu_list: astropy.io.fits.HDUList
+    :param index: int the HDU to read, or None for the first HDU with an image, which is what ds9 displays
+    :return: 2-D float32 array, trimmed to DATASEC, of the first plane of a cube, or None if there is no image
+    """
+    if index is None:
+        index = next((ii for ii, hdu in enumerate(hdu_list) if _has_image(hdu)), None)
+        if index is None:
+            return None
+    hdu = hdu_list[index]
+    if not _has_image(hdu):
+        return None
+    data = first_plane(hdu)
+    section = parse_section(hdu.header.get('DATASEC'))
+    if section is not None:
+        x1, x2, y1, y2 = section
+        data = data[min(y1, y2) - 1 : max(y1, y2), min(x1, x2) - 1 : max(x1, x2)]
+    return np.array(data, dtype=np.float32)
+
+
+def first_plane(hdu):
+    """
+    Read the first plane of a cube, as with fitscopy [*,*,1:1,1:1], without reading, or decompressing, the rest of
+    the cube.
+
+    :param hdu: astropy.io.fits image HDU
+    :return: 2-D array with the pixel type of the HDU
+    """
+    naxis = hdu.header.get('NAXIS', 0)
+    if naxis <= 2:
+        return hdu.data
+    first = (0,) * (naxis - 2)
+    if hdu.fileinfo() is None:
+        # an HDU that was not read from a file
+        return hdu.data[first]
+    # the section interface reads only the requested pixels from the file, or the requested tiles of a compressed HDU
+    return hdu.section[first]
+
+
+def image_count(hdu_list):
+    """:return the number of HDUs with an image"""
+    return sum(1 for hdu in hdu_list if _has_image(hdu))
+
+
+def scale_limits(data, scale_mode='zscale'):
+    """
+    :param data: array of pixel values
+    :param scale_mode: 'zscale' or 'minmax', as for ds9 -scale mode
+    :return: (low, high) display limits
+    """
+    finite = data[np.isfinite(data)]
+    if finite.size == 0:
+        return 0.0, 1.0
+    if scale_mode == 'minmax':
+        return float(finite.min()), float(finite.max())
+    low, high = _ZSCALE.get_limits(finite)
+    return float(low), float(high)
+
+
+def stretch(data, low, high, rotate=False):
+    """
+    Apply the squared stretch and inverted grey scale to data, and orient it for display.
+
+    :param data: 2-D array of pixel values
+    :param low: display limit, shown as white
+    :param high: display limit, shown as black
+    :param rotate: bool True to rotate by 180 degrees
+    :return: 2-D uint8 array
+    """
+    if high <= low:
+        high = low + 1.0
+    with np.errstate(invalid='ignore'):
+        scaled = np.clip((data - low) / (high - low), 0.0, 1.0)
+    scaled = scaled * scaled
+    pixels = np.where(np.isfinite(scaled), 255.0 * (1.0 - scaled), BACKGROUND).astype(np.uint8)
+    if rotate:
+        pixels = pixels[::-1, ::-1]
+    # the first FITS row is at the bottom of the display
+    return pixels[::-1]
+
+
+def block_average(data, factor):
+    """
+    :param data: 2-D array
+    :param factor: int number of pixels on a side to average together
+    :return: 2-D array reduced by factor on both axes, with the ragged edges dropped
+    """
+    if factor <= 1:
+        return data
+    ny = data.shape[0] // factor * factor
+    nx = data.shape[1] // factor * factor
+    if ny == 0 or nx == 0:
+        return data
+    return data[:ny, :nx].reshape(ny // factor, factor, nx // factor, factor).mean(axis=(1, 3))
+
+
+def reduction_factor(shape, size):
+    """:return int the block_average factor that reduces shape to no less than size on its longest side"""
+    return max(1, max(shape) // size)
+
+
+def fit(pixels, size):
+    """
+    Zoom to fit, like ds9 -zoom to fit, in a square frame.
+
+    :param pixels: 2-D uint8 array, from stretch
+    :param size: int width and height of the result
+    :return: PIL.Image.Image
+    """
+    height, width = pixels.shape
+    ratio = size / max(height, width)
+    new_width = max(1, int(round(width * ratio)))
+    new_height = max(1, int(round(height * ratio)))
+    image = Image.fromarray(pixels).resize((new_width, new_height), Image.BILINEAR)
+    result = Image.new('RGB', (size, size), (BACKGROUND, BACKGROUND, BACKGROUND))
+    result.paste(image, ((size - new_width) // 2, (size - new_height) // 2))
+    return result
+
+
+def pan(data, size, dx=0.0, dy=0.0):
+    """
+    Zoom 1, like ds9 -zoom 1 -pan dx dy.
+
+    :param data: 2-D array of pixel values
+    :param size: int width and height of the result
+    :param dx: offset, in pixels, of the centre of the view from the centre of the image, along the x axis
+    :param dy: offset along the y axis
+    :return: size x size float32 array, NaN where the view is outside the image
+    """
+    ny, nx = data.shape
+    x0 = int(round(nx / 2.0 + dx - size / 2.0))
+    y0 = int(round(ny / 2.0 + dy - size / 2.0))
+    result = np.full((size, size), np.nan, dtype=np.float32)
+    from_x, to_x = max(x0, 0), min(x0 + size, nx)
+    from_y, to_y = max(y0, 0), min(y0 + size, ny)
+    if from_x < to_x and from_y < to_y:
+        result[from_y - y0 : to_y - y0, from_x - x0 : to_x - x0] = data[from_y:to_y, from_x:to_x]
+    return result
+
+
+def _read_mosaic_section(fqn, index, detsec, factor, scale_mode, scope):
+    # each call opens the file, so the HDUs are read and decompressed independently in each thread, and only one
+    # full-resolution CCD per thread is in memory at a time
+    with fits.open(fqn, memmap=True) as hdu_list:
+        data = image_data(hdu_list, index)
+    x1, x2, y1, y2 = detsec
+    if x1 > x2:
+        data = data[:, ::-1]
+    if y1 > y2:
+        data = data[::-1]
+    sample = None
+    if scope == 'local':
+        low, high = scale_limits(data, scale_mode)
+    else:
+        finite = data[np.isfinite(data)]
+        if finite.size > 0:
+            if scale_mode == 'minmax':
+                sample = np.array([finite.min(), finite.max()])
+            else:
+                sample = finite[:: max(1, finite.size // _ZSCALE.n_samples)]
+    reduced = block_average(data, factor)
+    if scope == 'local':
+        # normalize each CCD by its own limits, so the mosaic is displayed with limits of 0 and 1
+        reduced = (reduced - low) / (high - low if high > low else 1.0)
+    return reduced.astype(np.float32), sample
+
+
+def mosaic(fqn, size, scale_mode='zscale', scope='global', workers=1):
+    """
+    Assemble the image HDUs of a MEF, like ds9 -mosaicimage iraf. The DATASEC of each HDU is placed on the canvas at
+    its DETSEC. Each HDU is reduced to the resolution of the canvas as it is read, so peak memory is the canvas, plus
+    one full-resolution HDU per worker.
+
+    :param fqn: str FITS file name
+    :param size: int the canvas is reduced to no less than this on its longest side
+    :param scale_mode: 'zscale' or 'minmax'
+    :param scope: 'local' for the limits of each HDU, 'global' for the limits of the whole mosaic
+    :param workers: int number of HDUs to read and reduce in parallel
+    :return: (canvas, low, high), where canvas is a 2-D float32 array, and low, high are the display limits, or None
+        if there is an image HDU without a DETSEC
+    """
+    sections = {}
+    with fits.open(fqn, memmap=True) as hdu_list:
+        for index, hdu in enumerate(hdu_list):
+            if _has_image(hdu):
+                detsec = parse_section(hdu.header.get('DETSEC'))
+                if detsec is None:
+                    return None
+                sections[index] = detsec
+    if len(sections) == 0:
+        return None
+
+    x_min = min(min(x1, x2) for x1, x2, ignore_y1, ignore_y2 in sections.values())
+    x_max = max(max(x1, x2) for x1, x2, ignore_y1, ignore_y2 in sections.values())
+    y_min = min(min(y1, y2) for ignore_x1, ignore_x2, y1, y2 in sections.values())
+    y_max = max(max(y1, y2) for ignore_x1, ignore_x2, y1, y2 in sections.values())
+    factor = reduction_factor((y_max - y_min + 1, x_max - x_min + 1), size)
+    canvas = np.full(
+        (-(-(y_max - y_min + 1) // factor), -(-(x_max - x_min + 1) // factor)), np.nan, dtype=np.float32
+    )
+
+    indices = list(sections.keys())
+    samples = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(indices)))) as executor:
+        results = executor.map(
+            lambda index: _read_mosaic_section(fqn, index, sections[index], factor, scale_mode, scope), indices
+        )
+        for index, (reduced, sample) in zip(indices, results):
+            x1, x2, y1, y2 = sections[index]
+            y0 = (min(y1, y2) - y_min) // factor
+            x0 = (min(x1, x2) - x_min) // factor
+            height = min(reduced.shape[0], canvas.shape[0] - y0)
+            width = min(reduced.shape[1], canvas.shape[1] - x0)
+            canvas[y0 : y0 + height, x0 : x0 + width] = reduced[:height, :width]
+            if sample is not None:
+                samples.append(sample)
+
+    if scope == 'local' or len(samples) == 0:
+        low, high = 0.0, 1.0
+    elif scale_mode == 'minmax':
+        pooled = np.concatenate(samples)
+        low, high = float(pooled.min()), float(pooled.max())
+    else:
+        low, high = _ZSCALE.get_limits(np.concatenate(samples))
+        low, high = float(low), float(high)
+    return canvas, low, high
+
+
+# the number of spectral channels of a cube to hold in memory at once
+CUBE_CHUNK_CHANNELS = 4
+
+
+def _cube_chunks(hdu, channels, rows, chunk_channels):
+    """Yield (channel, 2-D array) for each of the sorted channels, reading the cube chunk_channels at a time."""
+    for first in range(0, hdu.shape[0], chunk_channels):
+        last = min(first + chunk_channels, hdu.shape[0])
+        wanted = [channel for channel in channels if first <= channel < last]
+        if len(wanted) > 0:
+            # the section interface reads only the requested channels and rows
+            chunk = hdu.section[first:last, rows, :]
+            for channel in wanted:
+                yield channel, chunk[channel - first]
+
+
+def reduce_sitelle_cube(hdu, chunk_channels=CUBE_CHUNK_CHANNELS, median_stride=1):
+    """
+    Find the two strongest lines in a SITELLE calibrated cube, and make the line and continuum images of
+    genSiteprevperplane.py, without holding more than chunk_channels spectral channels in memory.
+
+    The channel medians and means are the same float32 operations, on the same values, as for the whole cube, so
+    the line selection, and the images, are the same.
+
+    :param hdu: the cube HDU, as opened by astropy, with axes (spectral, y, x)
+    :param chunk_channels: int number of spectral channels to read at once
+    :param median_stride: int > 1 to calculate each channel median from every median_stride-th row and column
+    :return: (line 1 + continuum, line 2 + continuum, continuum) 2-D arrays
+    """
+    nspecaxis = hdu.shape[0]
+    # trim off ends to make 2048x2048
+    rows = slice(8, 2056)
+    all_channels = np.arange(nspecaxis)
+
+    # trim off 30% of spectral edges - might be noisy - and those channels are zero
+    numedgechannels = int(0.15 * nspecaxis)
+    zeroed = set(all_channels[:numedgechannels]) | set(all_channels[(-1 * numedgechannels) :])
+
+    # pass 1 - the median of each channel, and the mean of each channel with its median subtracted
+    medians = {}
+    meanbgsubvswavenumber = np.zeros(nspecaxis, dtype=np.float64)
+    shape = None
+    dtype = None
+    for channel, data in _cube_chunks(
+        hdu, [ii for ii in all_channels if ii not in zeroed], rows, chunk_channels
+    ):
+        shape, dtype = data.shape, data.dtype
+        sample = data if median_stride <= 1 else data[::median_stride, ::median_stride]
+        medians[channel] = np.median(sample)
+        meanbgsubvswavenumber[channel] = np.mean((data - medians[channel]).ravel())
+    if shape is None:
+        shape, dtype = hdu.section[0:1, rows, :][0].shape, np.float32
+
+    # remove 7 channels around strongest line
+    indexmax1 = np.nanargmax(meanbgsubvswavenumber)
+    meanbgsubvswavenumber[indexmax1 - 3 : indexmax1 + 3] = 0.0
+    # remove 7 channels around second strongest line
+    indexmax2 = np.nanargmax(meanbgsubvswavenumber)
+    meanbgsubvswavenumber[indexmax2 - 3 : indexmax2 + 3] = 0.0
+    line1 = set(all_channels[indexmax1 - 1 : indexmax1 + 1])
+    line2 = set(all_channels[indexmax2 - 1 : indexmax2 + 1])
+    # "continuum" is everything except the two strongest lines
+    continuum = set(np.where(meanbgsubvswavenumber > 0.0)[0])
+
+    # pass 2 - mean images, accumulated in channel order, as np.mean(axis=0) does
+    sums = [None, None, None]
+    counts = [0, 0, 0]
+
+    def _accumulate(channel, data):
+        for index, members in enumerate([line1, line2, continuum]):
+            if channel in members:
+                if sums[index] is None:
+                    sums[index] = np.array(data, dtype=data.dtype)
+                else:
+                    sums[index] += data
+                counts[index] += 1
+
+    zero = np.zeros(shape, dtype=dtype)
+    for channel in sorted(zeroed & (line1 | line2 | continuum)):
+        _accumulate(channel, zero)
+    for channel, data in _cube_chunks(
+        hdu, sorted((line1 | line2 | continuum) - zeroed), rows, chunk_channels
+    ):
+        _accumulate(channel, data - medians[channel])
+
+    means = []
+    for total, count in zip(sums, counts):
+        if count == 0:
+            means.append(np.full(shape, np.nan, dtype=dtype))
+        else:
+            means.append(np.true_divide(total, count, out=total))
+    data2dline1, data2dline2, data2dcont = means
+    # add the continuum to the line images, so the whole image is not green
+    return data2dline1 + data2dcont, data2dline2 + data2dcont, data2dcont
+
+
+def _linear_channel(data, pmin, pmax):
+    # the aplpy.make_rgb_image linear stretch, between the pmin and pmax percentiles of the finite values
+    low, high = AsymmetricPercentileInterval(pmin, pmax).get_limits(data)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scaled = (data - low) / (high - low)
+    scaled = np.nan_to_num(np.clip(scaled, 0.0, 1.0))
+    return np.clip(scaled * 255.0, 0.0, 255.0).astype(np.uint8)
+
+
+def rgb(red, green, blue, pmin=(50.0, 95.0, 50.0), pmax=(99.5, 99.5, 99.5)):
+    """
+    Compose three 2-D arrays as an RGB image, with a linear stretch for each channel.
+
+    :param red: 2-D array
+    :param green: 2-D array, the same shape as red
+    :param blue: 2-D array, the same shape as red
+    :param pmin: (red, green, blue) lower percentile limits
+    :param pmax: (red, green, blue) upper percentile limits
+    :return: PIL.Image.Image, with the first FITS row at the bottom
+    """
+    channels = [
+        Image.fromarray(_linear_channel(data, low, high)) for data, low, high in zip([red, green, blue], pmin, pmax)
+    ]
+    return Image.merge('RGB', channels).transpose(Image.FLIP_TOP_BOTTOM)
+
+
+# the number of rows of a dataset to hold in memory at once, before they are reduced
+DATASET_CHUNK_ROWS = 256
+
+
+def reduce_dataset(dataset, size, chunk_rows=DATASET_CHUNK_ROWS):
+    """
+    Block-average a 2-D dataset to no less than size on its longest side, reading chunk_rows rows at a time, so the
+    full resolution dataset is never in memory.
+
+    :param dataset: 2-D array-like that supports slicing, like an h5py.Dataset
+    :param size: int the target size of the longest side
+    :param chunk_rows: int the number of rows to read at once, rounded down to a multiple of the reduction factor
+    :return: 2-D float32 array
+    """
+    factor = reduction_factor(dataset.shape, size)
+    ny = dataset.shape[0] // factor * factor
+    rows = max(factor, chunk_rows // factor * factor)
+    reduced = []
+    for first in range(0, ny, rows):
+        chunk = np.asarray(dataset[first : min(first + rows, ny), :], dtype=np.float32)
+        reduced.append(block_average(chunk, factor))
+    return np.concatenate(reduced)
+
+
+def colour_map(data, low, high, name='viridis'):
+    """
+    Colour data as imshow(data, vmin=low, vmax=high, cmap=name) does, without a figure.
+
+    :return: PIL.Image.Image in RGB, with the first row at the top, and NaNs in the background colour
+    """
+    with np.errstate(invalid='ignore'):
+        normalized = (data - low) / (high - low)
+    # values below low, including -inf, and above high, are clipped to the ends of the colour map
+    pixels = matplotlib.colormaps[name](normalized, bytes=True)[..., :3]
+    pixels[np.isnan(data)] = BACKGROUND
+    return Image.fromarray(pixels)
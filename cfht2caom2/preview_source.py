@@ -0,0 +1,157 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+
+"""
+A record of the science file content, and the preview generator version, that a set of previews was generated from,
+kept in a JPEG comment of each preview file. The previews are stored at CADC, so every run, on any node, can tell
+whether re-generating them for an unchanged file, with an unchanged generator, can be skipped.
+"""
+
+import json
+import logging
+import os
+import struct
+
+
+__all__ = ['PreviewSource', 'read', 'write']
+
+
+# JPEG markers
+_SOI = b'\xff\xd8'
+_COM = 0xFE
+_SOS = 0xDA
+# identifies the comment among any others in the file
+_KEY = 'cfht2caom2_preview_source'
+
+
+class PreviewSource:
+    """
+    The checksum URI of the science file content, the version of the preview generator, and the file names of all
+    the previews generated from them.
+    """
+
+    def __init__(self, checksum, version, previews):
+        self.checksum = checksum
+        self.version = version
+        self.previews = sorted(previews)
+
+    def __eq__(self, other):
+        return isinstance(other, PreviewSource) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f'PreviewSource({self.checksum}, {self.version}, {self.previews})'
+
+
+def write(fqn, source):
+    """
+    Add the source, as a JPEG comment segment directly after the start of image marker. The compressed image data
+    is not touched.
+
+    :param fqn: str the JPEG file
+    :param source: PreviewSource
+    :return: True if the file is a JPEG, and was re-written
+    """
+    with open(fqn, 'rb') as f:
+        content = f.read()
+    if not content.startswith(_SOI):
+        logging.warning(f'{fqn} is not a JPEG. Not recording the preview source.')
+        return False
+    payload = json.dumps({_KEY: vars(source)}, sort_keys=True).encode('utf-8')
+    segment = struct.pack('>BBH', 0xFF, _COM, len(payload) + 2) + payload
+    temp_fqn = f'{fqn}.tmp'
+    with open(temp_fqn, 'wb') as f:
+        f.write(_SOI + segment + content[len(_SOI):])
+    os.replace(temp_fqn, fqn)
+    return True
+
+
+def read(fqn):
+    """
+    :param fqn: str the JPEG file
+    :return: PreviewSource from the JPEG comment, or None, if there isn't one
+    """
+    with open(fqn, 'rb') as f:
+        content = f.read()
+    if not content.startswith(_SOI):
+        return None
+    offset = len(_SOI)
+    # the header segments, each 0xFF, marker, and a length that includes itself, end with the start of scan
+    while offset + 4 <= len(content) and content[offset] == 0xFF:
+        marker = content[offset + 1]
+        if marker == _SOS:
+            break
+        length = struct.unpack('>H', content[offset + 2:offset + 4])[0]
+        if marker == _COM:
+            try:
+                entry = json.loads(content[offset + 4:offset + 2 + length].decode('utf-8')).get(_KEY)
+            except (ValueError, AttributeError):
+                # someone else's comment
+                entry = None
+            if entry is not None:
+                return PreviewSource(entry.get('checksum'), entry.get('version'), entry.get('previews', []))
+        offset += 2 + length
+    return None
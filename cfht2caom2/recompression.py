@@ -0,0 +1,214 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+
+"""
+In-process decompression of gzipped FITS files, and recompression of them as tile-compressed FITS files, the
+equivalent of:
+
+    gunzip file.fits.gz
+    imcopy file.fits.gz 'file.fits.fz[compress]'
+
+The gzip stream is read once, an HDU at a time, and the HDUs are tile-compressed in parallel while the next ones are
+decompressed. Each compressed HDU is checked against the original pixels while both are still in memory, so the
+output file is not read again.
+"""
+
+import gzip
+import io
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from astropy.io import fits
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from caom2pipe import manage_composable as mc
+
+
+__all__ = ['can_recompress', 'decompress', 'recompress']
+
+
+# the fpack defaults - Rice for integer pixels, and lossless GZIP for floating point pixels
+INTEGER_COMPRESSION = 'RICE_1'
+FLOAT_COMPRESSION = 'GZIP_2'
+# bytes to copy at a time when decompressing
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def _to_bytes(hdu_list):
+    buffer = io.BytesIO()
+    hdu_list.writeto(buffer, checksum=True)
+    return buffer.getvalue()
+
+
+# an extension HDU is serialized after an empty primary HDU, which is then dropped
+_EMPTY_PRIMARY = _to_bytes(fits.HDUList([fits.PrimaryHDU()]))
+
+
+def _is_image(header):
+    return header.get('XTENSION', 'IMAGE') == 'IMAGE' and header.get('NAXIS', 0) > 0
+
+
+def can_recompress(headers):
+    """
+    :param headers: list of astropy.io.fits.Header, one per HDU of the gzipped file
+    :return: True if recompress preserves the pixel values of every HDU. Pixels scaled with anything other than the
+        signed byte, or unsigned integer, conventions of BZERO, and files that are already tile-compressed, are left
+        to imcopy.
+    """
+    for header in headers:
+        if header.get('ZIMAGE'):
+            return False
+        if _is_image(header):
+            bitpix = header.get('BITPIX')
+            if header.get('BSCALE', 1) != 1:
+                return False
+            if bitpix == 8:
+                # bytes are unsigned, and BZERO = -128 makes them signed
+                unscaled = [0, -128]
+            elif bitpix > 0:
+                unscaled = [0, 2 ** (bitpix - 1)]
+            else:
+                unscaled = [0]
+            if header.get('BZERO', 0) not in unscaled:
+                return False
+    return True
+
+
+def _compress(header, data):
+    """:return: bytes of the tile-compressed extension for one image HDU, checked against data"""
+    if data.dtype.kind == 'f':
+        hdu = fits.CompImageHDU(data, header, compression_type=FLOAT_COMPRESSION, quantize_level=0.0)
+    else:
+        hdu = fits.CompImageHDU(data, header, compression_type=INTEGER_COMPRESSION)
+    result = _to_bytes(fits.HDUList([fits.PrimaryHDU(), hdu]))
+    with fits.open(io.BytesIO(result)) as check:
+        if not np.array_equal(check[1].data, data, equal_nan=data.dtype.kind == 'f'):
+            raise mc.CadcException(f'Tile compression of HDU {header.get("EXTNAME")} is not lossless.')
+    return result[len(_EMPTY_PRIMARY) :]
+
+
+def _copy(header, data):
+    """:return: bytes of an extension HDU that is not compressed, like a table"""
+    hdu_class = {'BINTABLE': fits.BinTableHDU, 'TABLE': fits.TableHDU}.get(header.get('XTENSION'), fits.ImageHDU)
+    hdu = hdu_class(data, header)
+    return _to_bytes(fits.HDUList([fits.PrimaryHDU(), hdu]))[len(_EMPTY_PRIMARY) :]
+
+
+def decompress(source_fqn, dest_fqn):
+    """gunzip source_fqn to dest_fqn, a chunk at a time."""
+    with gzip.open(source_fqn, 'rb') as f_in, open(dest_fqn, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+
+
+def recompress(source_fqn, dest_fqn, workers=1):
+    """
+    Write the gzipped FITS file source_fqn as the tile-compressed FITS file dest_fqn. As with fpack, an image in the
+    primary HDU is moved to the first extension, and the primary HDU of dest_fqn is empty.
+
+    :param workers: int the number of HDUs to compress at once
+    """
+    logging.debug(f'Recompress {source_fqn} as {dest_fqn} with {workers} workers.')
+    try:
+        with gzip.open(source_fqn, 'rb') as f_in, fits.open(f_in) as hdu_list, open(dest_fqn, 'wb') as f_out:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                index = 0
+                while True:
+                    try:
+                        # HDUs are read in order, so the gzip stream is never re-wound
+                        hdu = hdu_list[index]
+                    except IndexError:
+                        break
+                    header = hdu.header.copy()
+                    data = hdu.data
+                    # the HDUList does not keep the pixels, only the pending compression does
+                    del hdu.data
+                    if index == 0 and data is None:
+                        f_out.write(_to_bytes(fits.HDUList([fits.PrimaryHDU(header=header)])))
+                    else:
+                        if index == 0:
+                            f_out.write(_EMPTY_PRIMARY)
+                        if _is_image(header) and data is not None:
+                            pending.append(executor.submit(_compress, header, data))
+                        else:
+                            pending.append(executor.submit(_copy, header, data))
+                    del data
+                    # bound the number of HDUs in memory, and write the compressed HDUs in the original order
+                    while len(pending) > workers:
+                        f_out.write(pending.popleft().result())
+                    index += 1
+                while len(pending) > 0:
+                    f_out.write(pending.popleft().result())
+    except Exception:
+        if os.path.exists(dest_fqn):
+            os.unlink(dest_fqn)
+        raise
+    logging.debug(f'Wrote {index} HDUs to {dest_fqn}.')
@@ -117,6 +117,16 @@ def test_project_titles_cache(query_mock):
     ), 'wrong result'
 
 
+def test_filter_repair_index():
+    test_subject = md.cache
+    lookup = test_subject.get_from(md.FILTER_REPAIR_CACHE)
+    for value in set(lookup.values()):
+        expected = next(key for key, entry in lookup.items() if entry == value)
+        assert test_subject.get_repaired_filter_name(value) == expected, f'wrong key for {value}'
+        assert md.reverse_lookup(value) == expected, f'wrong reverse lookup for {value}'
+    assert test_subject.get_repaired_filter_name('i.MP9701') is None, 'not repaired'
+
+
 def _mock_query(url):
     class Object(object):
         def __init__(self):
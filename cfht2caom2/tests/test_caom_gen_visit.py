@@ -77,7 +77,9 @@ from mock import Mock, patch
 from os import unlink
 from os.path import basename, dirname, exists, join, realpath
 
+from astropy.io import fits
 from astropy.io.votable import parse_single_table
+from caom2 import Artifact, ProductType, ReleaseType
 from caom2.diff import get_differences
 from caom2pipe.manage_composable import (
     CadcException,
@@ -87,6 +89,8 @@ from caom2pipe.manage_composable import (
     TaskType,
     write_obs_to_file,
 )
+from caom2utils.blueprints import ObsBlueprint
+from caom2utils.caom2blueprint import FitsParser
 from caom2utils.data_util import get_local_file_headers, get_local_file_info
 from cfht2caom2.cfht_name import CFHTName, CFHTMetaVisitRunnerMeta
 from cfht2caom2 import file2caom2_augmentation
@@ -99,8 +103,9 @@ SINGLE_PLANE_DIR = join(TEST_DATA_DIR, 'single_plane')
 
 
 def pytest_generate_tests(metafunc):
-    obs_id_list = glob.glob(f'{SINGLE_PLANE_DIR}/**/*.fits.header')
-    metafunc.parametrize('test_name', obs_id_list)
+    if 'test_name' in metafunc.fixturenames:
+        obs_id_list = glob.glob(f'{SINGLE_PLANE_DIR}/**/*.fits.header')
+        metafunc.parametrize('test_name', obs_id_list)
 
 
 @patch('cfht2caom2.metadata.CFHTCache._try_to_append_to_cache')
@@ -184,6 +189,46 @@ def test_visitor(vo_mock, cache_mock, test_name, test_config, tmp_path, change_t
     # assert False
 
 
+def test_parallel_wcs_parser():
+    headers = []
+    for index in range(6):
+        header = fits.Header()
+        header['NAXIS'] = 2
+        header['NAXIS1'] = 2048
+        header['NAXIS2'] = 4612
+        header['BITPIX'] = 16
+        header['CTYPE1'] = 'RA---TAN'
+        header['CTYPE2'] = 'DEC--TAN'
+        header['CUNIT1'] = 'deg'
+        header['CUNIT2'] = 'deg'
+        header['CRPIX1'] = 1024.0 + index
+        header['CRPIX2'] = 2306.0
+        header['CRVAL1'] = 210.0 + index / 10.0
+        header['CRVAL2'] = 54.0
+        header['CD1_1'] = -0.000051
+        header['CD1_2'] = 0.0
+        header['CD2_1'] = 0.0
+        header['CD2_2'] = 0.000051
+        headers.append(header)
+
+    def _augment(parser):
+        artifact = Artifact('cadc:CFHT/1000003o.fits.fz', ProductType.SCIENCE, ReleaseType.DATA)
+        parser.augment_artifact(artifact)
+        return artifact
+
+    blueprint = ObsBlueprint(position_axes=(1, 2))
+    expected = _augment(FitsParser(headers, blueprint, 'cadc:CFHT/1000003o.fits.fz'))
+    test_result = _augment(
+        file2caom2_augmentation.CFHTFitsParser(headers, blueprint, 'cadc:CFHT/1000003o.fits.fz', workers=4)
+    )
+    assert list(test_result.parts.keys()) == list(expected.parts.keys()), 'part order'
+    for part_name, part in expected.parts.items():
+        expected_function = part.chunks[0].position.axis.function
+        test_function = test_result.parts[part_name].chunks[0].position.axis.function
+        assert test_function.ref_coord.coord1.val == expected_function.ref_coord.coord1.val, f'coord1 {part_name}'
+        assert test_function.ref_coord.coord1.pix == expected_function.ref_coord.coord1.pix, f'pix1 {part_name}'
+
+
 def _compare(test_name, observation, obs_id):
     if observation is None:
         assert False, f'No observation for {obs_id}'
@@ -69,6 +69,7 @@
 import h5py
 import os
 import shutil
+import threading
 import warnings
 
 from astropy.io import fits
@@ -191,6 +192,68 @@ def test_run_store(
     clients_mock.return_value.metadata_client.read.assert_called_with('CFHT', '1000003'), 'caom2 read'
 
 
+@patch('caom2pipe.execute_composable.FitsForCADCCompressor.fix_compression')
+@patch('caom2pipe.astro_composable.get_vo_table')
+@patch('cfht2caom2.metadata.CFHTCache._try_to_append_to_cache')
+@patch('caom2pipe.astro_composable.check_fitsverify')
+@patch('caom2pipe.client_composable.ClientCollection', autospec=True)
+def test_run_store_ingest_overlap(
+    clients_mock,
+    check_fits_mock,
+    cache_mock,
+    vo_mock,
+    compression_mock,
+    test_data_dir,
+    test_config,
+    tmp_path,
+    change_test_dir,
+):
+    # with overlap_store, the observation is read and mapped while the file is stored, and the observation is
+    # stored after the file is
+    compression_mock.side_effect = _mock_fix_compression
+    test_config.change_working_directory(tmp_path.as_posix())
+    test_config.data_sources = [f'{test_data_dir}/store_test']
+    test_config.task_types = [TaskType.STORE, TaskType.INGEST]
+    test_config.data_source_extensions = ['.fits.fz']
+    test_config.use_local_files = True
+    test_config.logging_level = 'DEBUG'
+    mc.Config.write_to_file(test_config)
+    with open('config.yml', 'a') as f:
+        f.write('overlap_store: true\n')
+
+    read = threading.Event()
+    steps = []
+
+    def _mock_put(working_directory, uri):
+        # block until the observation has been read, so the test fails if the two steps do not overlap
+        assert read.wait(10), 'the observation is read while the file is stored'
+        steps.append('put')
+
+    def _mock_read(collection, obs_id):
+        steps.append('read')
+        read.set()
+        return _mock_repo_read_not_none(collection, obs_id)
+
+    def _mock_update(observation):
+        steps.append('update')
+
+    clients_mock.return_value.metadata_client.read.side_effect = _mock_read
+    clients_mock.return_value.metadata_client.update.side_effect = _mock_update
+    clients_mock.return_value.data_client.put.side_effect = _mock_put
+    clients_mock.return_value.data_client.info.side_effect = _mock_get_file_info
+    check_fits_mock.return_value = True
+
+    # execution
+    test_result = composable._run()
+    assert test_result == 0, 'wrong result'
+    clients_mock.return_value.data_client.put.assert_called_with(
+        test_config.data_sources[0], 'cadc:CFHT/1000003f.fits.fz'
+    ), 'put'
+    assert steps == ['read', 'put', 'update'], f'steps {steps}'
+    execution_summary = mc.ExecutionSummary.read_report_file(test_config.report_fqn)
+    assert execution_summary.success == 1, 'success'
+
+
 @patch('caom2pipe.astro_composable.get_vo_table')
 @patch('caom2pipe.execute_composable.FitsForCADCCompressor.fix_compression')
 @patch('cfht2caom2.metadata.CFHTCache._try_to_append_to_cache')
@@ -0,0 +1,131 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2020.                            (c) 2020.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 4 $
+#
+# ***********************************************************************
+#
+
+from hashlib import md5
+from unittest.mock import Mock, patch
+
+from cfht2caom2 import data_source
+
+
+def test_modified_files(test_config, tmp_path):
+    unchanged = tmp_path / '1028439o.fits'
+    unchanged.write_bytes(b'unchanged')
+    changed = tmp_path / '2359320o.fits.fz'
+    changed.write_bytes(b'changed')
+    new = tmp_path / '1681594g.fits.fz'
+    new.write_bytes(b'new')
+    gzipped = tmp_path / '781920i.fits.gz'
+    gzipped.write_bytes(b'gzipped')
+    test_holdings = data_source.LocalHoldings(
+        {
+            'cadc:CFHT/1028439o.fits': f'md5:{md5(b"unchanged").hexdigest()}',
+            'cadc:CFHT/2359320o.fits.fz': md5(b'original').hexdigest(),
+            'cadc:CFHT/781920i.fits': md5(b'gzipped').hexdigest(),
+        }
+    )
+    fqns = [str(unchanged), str(changed), str(new), str(gzipped)]
+    test_result = data_source.modified_files(fqns, test_holdings, workers=2, batch_size=2)
+    assert test_result == {str(changed), str(new), str(gzipped)}, 'wrong subset'
+    # the gzipped file is not queried, so the other three files are two batches
+    assert test_holdings.query_count == 2, 'wrong query count'
+
+
+def test_tap_holdings():
+    def _mock_query(query_string, output_file, data_only, response_format):
+        assert 'FROM inventory.Artifact' in query_string, query_string
+        assert "uri IN ('cadc:CFHT/1028439o.fits', 'cadc:CFHT/a''b.fits')" in query_string, query_string
+        output_file.write('uri,contentChecksum\ncadc:CFHT/1028439o.fits,md5:abc\n')
+
+    tap_client = Mock()
+    tap_client.query.side_effect = _mock_query
+    test_subject = data_source.TapHoldings(tap_client, 'inventory.Artifact')
+    test_result = test_subject.checksums(['cadc:CFHT/1028439o.fits', "cadc:CFHT/a'b.fits"])
+    assert test_result == {'cadc:CFHT/1028439o.fits': 'abc'}, 'wrong checksums'
+    assert tap_client.query.call_count == 1, 'one query per batch'
+
+
+@patch('cfht2caom2.data_source.net.Subject')
+@patch('cfht2caom2.data_source.CadcTapClient')
+def test_inventory_holdings(tap_mock, subject_mock, test_config):
+    def _mock_query(query_string, output_file, data_only, response_format):
+        assert 'FROM inventory.Artifact' in query_string, query_string
+        output_file.write('uri,contentChecksum\ncadc:CFHT/1028439o.fits,md5:abc\n')
+
+    test_config.proxy_fqn = '/tmp/cadcproxy.pem'
+    tap_mock.return_value.query.side_effect = _mock_query
+    test_subject = data_source.inventory_holdings(test_config)
+    subject_mock.assert_called_with(certificate='/tmp/cadcproxy.pem')
+    tap_mock.assert_called_with(subject_mock.return_value, resource_id='ivo://cadc.nrc.ca/global/luskan')
+    test_result = test_subject.checksums(['cadc:CFHT/1028439o.fits'])
+    assert test_result == {'cadc:CFHT/1028439o.fits': 'abc'}, 'storage inventory checksums'
+
+    test_config.holdings_table = 'caom2.Artifact'
+    test_config.holdings_resource_id = 'ivo://cadc.nrc.ca/argus'
+    tap_mock.return_value.query.side_effect = lambda query_string, **kwargs: query_string.index('FROM caom2.Artifact')
+    data_source.inventory_holdings(test_config).checksums(['cadc:CFHT/1028439o.fits'])
+    tap_mock.assert_called_with(subject_mock.return_value, resource_id='ivo://cadc.nrc.ca/argus')
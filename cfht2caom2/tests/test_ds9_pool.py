@@ -0,0 +1,157 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import pytest
+
+from mock import Mock, patch
+
+from caom2pipe.manage_composable import CadcException
+from cfht2caom2 import ds9_pool
+
+
+def test_xpa_commands():
+    load, view = ds9_pool.xpa_commands(
+        '/data/2452990o.fits.fz',
+        '1024x1024',
+        '/data/2452990o_preview_1024.jpg',
+        'local',
+        '-rotate 180',
+        mosaic_param='-mosaicimage iraf',
+        mode_param='',
+        scale_param='zscale',
+    )
+    assert load == ['frame clear', 'mosaicimage iraf /data/2452990o.fits.fz'], 'mosaic load'
+    assert view == [
+        'width 1024',
+        'height 1024',
+        'rotate 0',
+        'frame center',
+        'rotate 180',
+        'scale squared',
+        'scale mode zscale',
+        'scale scope local',
+        'scale datasec yes',
+        'cmap invert yes',
+        'view colorbar no',
+        'zoom to fit',
+        'saveimage jpeg /data/2452990o_preview_1024.jpg',
+    ], 'view'
+
+    load, view = ds9_pool.xpa_commands(
+        '',
+        '1024x1024',
+        '/data/2452990o_preview_zoom_1024.jpg',
+        'global',
+        '',
+        '1',
+        '-pan -9 1780',
+        mosaic_param='-fits /data/2452990o.fits.fz[23]',
+        scale_param='zscale',
+    )
+    assert load == ['frame clear', 'fits /data/2452990o.fits.fz[23]'], 'one HDU load'
+    assert 'pan -9 1780' in view, 'relative pan'
+    assert 'mode none' in view, 'default mode'
+    assert view.index('zoom 1') < view.index('pan -9 1780'), 'pan after zoom'
+
+
+@patch('cfht2caom2.ds9_pool.subprocess')
+def test_server_respawn(subprocess_mock, tmp_path):
+    subprocess_mock.run.return_value = Mock(stdout='yes\n')
+    subprocess_mock.Popen.return_value.poll.return_value = None
+    test_subject = ds9_pool.Ds9Server('test_ds9')
+    test_subject.start()
+    assert subprocess_mock.Popen.call_count == 1, 'start'
+    test_subject.render(['frame clear', 'fits a.fits'], ['saveimage jpeg a.jpg'])
+    test_subject.render(['frame clear', 'fits a.fits'], ['saveimage jpeg b.jpg'])
+    commands = [c.args[0][3:] for c in subprocess_mock.run.call_args_list if c.args[0][0] == 'xpaset']
+    assert commands == [['frame', 'clear'], ['fits', 'a.fits'], ['saveimage', 'jpeg', 'a.jpg'],
+                        ['saveimage', 'jpeg', 'b.jpg']], 'one load for two views'
+
+    # the same path, written again
+    subprocess_mock.run.reset_mock()
+    science_fqn = tmp_path / 'c.fits'
+    science_fqn.write_bytes(b'first')
+    load = ['frame clear', f'fits {science_fqn}[1]']
+    test_subject.render(load, ['saveimage jpeg c.jpg'])
+    test_subject.render(load, ['saveimage jpeg c_256.jpg'])
+    science_fqn.write_bytes(b'second version')
+    test_subject.render(load, ['saveimage jpeg c.jpg'])
+    commands = [c.args[0][3:] for c in subprocess_mock.run.call_args_list if c.args[0][0] == 'xpaset']
+    assert commands.count(['fits', f'{science_fqn}[1]']) == 2, 'a re-written file is loaded again'
+
+    # the process went away
+    subprocess_mock.Popen.return_value.poll.side_effect = [1, None]
+    test_subject.ensure()
+    assert subprocess_mock.Popen.call_count == 2, 'respawn'
+
+    # the process stopped answering
+    subprocess_mock.run.return_value = Mock(stdout='no\n')
+    subprocess_mock.Popen.return_value.poll.side_effect = None
+    with patch('cfht2caom2.ds9_pool.STARTUP_TIMEOUT', 0):
+        with pytest.raises(CadcException):
+            test_subject.ensure()
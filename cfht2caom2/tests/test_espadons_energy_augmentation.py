@@ -65,6 +65,9 @@
 #
 # ***********************************************************************
 
+import numpy as np
+
+from astropy.io import fits
 from os.path import join
 
 from caom2pipe.manage_composable import read_obs_from_file
@@ -171,3 +174,33 @@ def test_visit_i_p(test_config, test_data_dir):
     assert test_p.observable.independent.axis.ctype == 'WAVE', 'i ctype'
     assert test_p.observable.independent.axis.cunit == 'nm', 'i cunit'
     assert test_p.observable.independent.bin == 1, 'i bin'
+
+
+def test_read_wavelengths(tmp_path):
+    spectrum = np.arange(3 * 10, dtype=np.float32).reshape(3, 10)
+    primary = fits.PrimaryHDU(spectrum)
+    primary.header['OBSTYPE'] = 'OBJECT'
+    for f_name, hdu_list in {
+        'primary.fits': fits.HDUList([primary]),
+        'extension.fits.gz': fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(spectrum)]),
+        'compressed.fits.fz': fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(spectrum)]),
+    }.items():
+        fqn = str(tmp_path / f_name)
+        hdu_list.writeto(fqn)
+        wave, hdr = espadons_energy_augmentation._read_wavelengths(fqn)
+        np.testing.assert_array_equal(wave, spectrum[0], f'wavelengths {f_name}')
+        assert hdr.get('SIMPLE'), f'primary header {f_name}'
+
+
+def test_build_energy_bounds():
+    # three echelle orders, in order, with the first two overlapping, and a gap before the third
+    orders = [np.linspace(370.0, 380.0, 4001), np.linspace(379.0, 390.0, 4001), np.linspace(400.0, 410.0, 4001)]
+    wave = np.concatenate(orders)
+    wave[10] = np.nan
+    test_result = espadons_energy_augmentation.build_energy_bounds(wave)
+    assert len(test_result.samples) == 2, 'overlapping orders merge, gaps are kept'
+    assert test_result.samples[0].start.val == 370.0, 'first start'
+    assert test_result.samples[0].end.val == 390.0, 'first end'
+    assert test_result.samples[1].start.val == 400.0, 'second start'
+    assert test_result.samples[1].end.val == 410.0, 'second end'
+    assert len(espadons_energy_augmentation.build_energy_bounds(np.array([np.nan])).samples) == 0, 'no wavelengths'
@@ -0,0 +1,323 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2025.                            (c) 2025.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import pytest
+
+from astropy.io import fits
+from astropy.time import Time
+from datetime import datetime
+from mock import Mock, patch
+
+from caom2 import Algorithm, Artifact, Axis, Chunk, CoordAxis1D, ObservationIntentType, Part, Plane, ProductType
+from caom2 import ReleaseType, SimpleObservation, SpectralWCS
+from caom2utils.blueprints import ObsBlueprint
+from caom2pipe.manage_composable import CadcException
+from cfht2caom2 import CFHTName, instruments
+from cfht2caom2.metadata import Inst
+
+
+def _mapping(mapping_class, f_name, instrument, observation=None, config=None):
+    storage_name = CFHTName(source_names=[f_name], instrument=instrument)
+    storage_name.metadata[storage_name.file_uri] = [fits.Header()]
+    return mapping_class(storage_name, Mock(), Mock(), observation, config)
+
+
+def test_blueprint_template(test_config):
+    instruments._blueprint_templates.clear()
+    first = _mapping(instruments.Mega, '2452990p.fits.fz', Inst.MEGAPRIME, config=test_config)
+    first_bp = ObsBlueprint(instantiated_class=first)
+    first.accumulate_blueprint(first_bp)
+    assert len(instruments._blueprint_templates) == 1, 'template'
+
+    second = _mapping(instruments.Mega, '2452991p.fits.fz', Inst.MEGAPRIME, config=test_config)
+    second_bp = ObsBlueprint(instantiated_class=second)
+    second.accumulate_blueprint(second_bp)
+    assert len(instruments._blueprint_templates) == 1, 'template re-use'
+    assert first_bp._module_instance._mapping is first, 'first instance'
+    assert second_bp._module_instance._mapping is second, 'second instance'
+    assert first_bp._plan['Observation.sequenceNumber'] == (['EXPNUM'], '2452990'), 'first sequence number'
+    assert second_bp._plan['Observation.sequenceNumber'] == (['EXPNUM'], '2452991'), 'second sequence number'
+    # the copies are independent of the template and of each other
+    second_bp.add_attribute('Observation.proposal.id', 'TEST')
+    assert 'TEST' not in first_bp._plan['Observation.proposal.id'][0], 'shared plan'
+
+    # a different naming profile builds a different template
+    third = _mapping(instruments.SitelleP, '2384125v.fits.fz', Inst.SITELLE, config=test_config)
+    third_bp = ObsBlueprint(instantiated_class=third)
+    third.accumulate_blueprint(third_bp)
+    assert len(instruments._blueprint_templates) == 2, 'second template'
+    assert third_bp._plan['Observation.sequenceNumber'] == '2384125', 'v sequence number'
+
+
+def test_blueprint_template_existing_observation(test_config):
+    instruments._blueprint_templates.clear()
+    observation = SimpleObservation(collection='CFHT', observation_id='1013501', algorithm=Algorithm('exposure'))
+    observation.sequence_number = 1013501
+    test_subject = _mapping(instruments.MegaFlag, '1013501p_flag.fits.fz', Inst.MEGAPRIME, observation, test_config)
+    test_bp = ObsBlueprint(instantiated_class=test_subject)
+    test_subject.accumulate_blueprint(test_bp)
+    assert test_bp._plan['Observation.sequenceNumber'] == 1013501, 'existing sequence number'
+    # the existing Observation values are not part of the template
+    template = list(instruments._blueprint_templates.values())[0]
+    assert template._plan['Observation.sequenceNumber'] == (['EXPNUM'], None), 'template sequence number'
+
+
+def test_blueprint_instance_members():
+    # the members a template copy takes from the caller's ObsBlueprint are the ones set from the constructor parameters
+    # that identify the executing instance - anything else is blueprint content, and comes from the template
+    default = vars(ObsBlueprint())
+    instance = vars(ObsBlueprint(module=instruments, update=False, instantiated_class=object()))
+    assert default.keys() == instance.keys(), 'members'
+    differ = [name for name in default if default[name] is not instance[name] and default[name] != instance[name]]
+    assert sorted(differ) == sorted(instruments._BLUEPRINT_INSTANCE_MEMBERS), 'instance members'
+
+
+def test_blueprint_getters(test_config):
+    instruments._blueprint_templates.clear()
+    test_subject = _mapping(instruments.Mega, '2452990p.fits.fz', Inst.MEGAPRIME, config=test_config)
+    test_bp = ObsBlueprint(instantiated_class=test_subject)
+    test_subject.accumulate_blueprint(test_bp)
+    getters = test_bp._module_instance
+    assert isinstance(getters, instruments.BlueprintGetters), 'getters'
+    assert 'get_obs_intent' in vars(getters), 'bound once'
+    assert getters.get_obs_intent.__self__ is test_subject, 'bound to mapping'
+
+    class BadMega(instruments.Mega):
+        def _accumulate_blueprint(self, bp):
+            super()._accumulate_blueprint(bp)
+            bp.set('Observation.type', 'get_obs_typo()')
+
+    test_subject = _mapping(BadMega, '2452990p.fits.fz', Inst.MEGAPRIME, config=test_config)
+    with pytest.raises(CadcException, match='get_obs_typo'):
+        test_subject.accumulate_blueprint(ObsBlueprint(instantiated_class=test_subject))
+
+
+def test_memoize_derived_values(test_config):
+    test_subject = _mapping(instruments.Mega, '2452990p.fits.fz', Inst.MEGAPRIME, config=test_config)
+    header = fits.Header()
+    header['OBSTYPE'] = 'OBJECT'
+    header['RUNID'] = '19AQ01'
+    header['OBJRA'] = '10:00:00.0'
+    header['OBJDEC'] = '+20:00:00.0'
+    header['OBJRADEC'] = 'FK5'
+    test_subject._headers = [header, header.copy()]
+    with patch('caom2pipe.astro_composable.build_ra_dec_as_deg', return_value=(150.0, 20.0)) as ra_dec_mock:
+        assert test_subject.get_target_position_cval1(0) == 150.0, 'ra'
+        assert test_subject.get_target_position_cval2(0) == 20.0, 'dec'
+        assert test_subject.get_target_position_cval1(1) == 150.0, 'ra, same values, other extension'
+        assert ra_dec_mock.call_count == 1, 'derived once'
+        test_subject._headers[1]['OBJRA'] = '11:00:00.0'
+        test_subject.get_target_position_cval1(1)
+        assert ra_dec_mock.call_count == 2, 'header change'
+
+    assert test_subject.get_obs_intent(0) == ObservationIntentType.CALIBRATION, 'q intent'
+    header['RUNID'] = '19AE01'
+    assert test_subject.get_obs_intent(0) == ObservationIntentType.SCIENCE, 'changed intent'
+    assert test_subject._get_run_id(0) == '19AE01', 'changed run id'
+
+
+def test_update_artifact_filter(test_config):
+    test_subject = _mapping(instruments.Mega, '2452990p.fits.fz', Inst.MEGAPRIME, config=test_config)
+    headers = [fits.Header()] + [fits.Header({'FILTER': 'r.MP9602'}) for _ in range(3)]
+    test_subject._headers = headers
+    filter_md = {'cw': 6250.0, 'fwhm': 1200.0}
+    with patch('cfht2caom2.instruments.get_filter_md', return_value=(filter_md, 'r.MP9602')) as filter_mock:
+        test_subject.update_artifact()
+        for _ in range(3):
+            test_subject.chunk = Chunk()
+            test_subject.update_energy()
+            assert test_subject.chunk.energy is not None, 'energy'
+            assert test_subject.chunk.energy.bandpass_name == 'r.MP9602', 'bandpass name'
+        assert filter_mock.call_count == 1, 'one filter resolution per artifact'
+
+
+def test_get_filter_md_memo(test_config):
+    instruments._filter_md_memo.clear()
+    storage_name = CFHTName(source_names=['2452990p.fits.fz'], instrument=Inst.MEGAPRIME)
+    filter_md = {'cw': 6250.0, 'fwhm': 1200.0}
+    with patch('cfht2caom2.metadata.filter_cache') as filter_cache_mock:
+        filter_cache_mock.get_svo_filter.return_value = filter_md
+        filter_cache_mock.is_cached.return_value = True
+        for _ in range(3):
+            test_md, test_name = instruments.get_filter_md('r.MP9602', storage_name)
+            assert test_md == filter_md, 'filter md'
+            assert test_name == 'r.MP9602', 'filter name'
+        assert filter_cache_mock.get_svo_filter.call_count == 1, 'one resolution per filter'
+
+        filter_cache_mock.is_cached.return_value = False
+        with pytest.raises(CadcException):
+            instruments.get_filter_md('unknown', storage_name)
+        with pytest.raises(CadcException):
+            # failures are not remembered
+            instruments.get_filter_md('unknown', storage_name)
+
+
+def test_cfht_mjd():
+    for value in [
+        '2019-05-27',
+        '2019-05-27T09:45:12',
+        '2019-05-27 09:45:12.5',
+        '2016-12-31T23:59:59.999999',
+        '2008-02-01T5:06:07.123',
+    ]:
+        expected = Time(datetime.strptime(value.replace(' ', 'T'), _format(value)))
+        expected.format = 'mjd'
+        assert instruments.cfht_mjd(value) == expected.value, f'wrong mjd for {value}'
+        assert instruments.cfht_time_helper(value).value == expected.value, f'wrong Time for {value}'
+    assert instruments.cfht_mjd(None) is None, 'None'
+    first = instruments.cfht_time_helper('2019-05-27T09:45:12')
+    first.format = 'isot'
+    assert instruments.cfht_time_helper('2019-05-27T09:45:12').format == 'mjd', 'callers share a Time'
+    assert instruments._iso_datetime('1970-00-01') is None, 'invalid month'
+    assert instruments._iso_datetime('2019-05-27T09:45:12.1234567') is None, 'too precise for the fast path'
+
+
+def _format(value):
+    if 'T' not in value and ' ' not in value:
+        return '%Y-%m-%d'
+    elif '.' in value:
+        return '%Y-%m-%dT%H:%M:%S.%f'
+    else:
+        return '%Y-%m-%dT%H:%M:%S'
+
+
+def test_scan_provenance():
+    headers = []
+    for ccd in range(3):
+        header = fits.Header()
+        header['IMCMB_FT'] = 'MASTER_DETREND_BIAS'
+        header['IMCMB001'] = f'2463481b.fits[ccd{ccd:02d}] 1231 1 1225 1'
+        header['IMCMB002'] = '707809o00.fits 0 1569 0.341'
+        headers.append(header)
+    test_result = instruments._scan_provenance(headers, instruments.ProvenanceType.IMCMB, '2463500')
+    assert test_result == {('2463481', '2463481b'), ('707809', '707809o')}, 'imcmb'
+
+    header = fits.Header()
+    header['FILENAME'] = '2452990p39'
+    header['FILENAM1'] = '2401734o.fits'
+    header['FILENAM2'] = '2401735o'
+    test_result = instruments._scan_provenance([header, header], instruments.ProvenanceType.FILENAME, '2452990')
+    assert test_result == {('2401734', '2401734o'), ('2401735', '2401735o')}, 'filename'
+
+    header = fits.Header()
+    header.add_comment('Scan member=2445653o st=174 iq=1.2200 bk=5.5214 ex=0.024000')
+    header.add_comment('Flat member=2445211f')
+    header.add_comment('Scan member=2445654o st=175')
+    test_result = instruments._scan_provenance([header], instruments.ProvenanceType.COMMENT, '2445660')
+    assert test_result == {('2445653', '2445653o'), ('2445654', '2445654o')}, 'comment'
+
+
+def test_repair_file():
+    storage_name = CFHTName(source_names=['2452990p.fits.fz'], instrument=Inst.MEGAPRIME)
+    observation = SimpleObservation(collection='CFHT', observation_id='2452990', algorithm=Algorithm('exposure'))
+    observation.type = 'FRPTS'
+    for product_id, uri in [('2452990p', storage_name.file_uri), ('2452990o', 'cadc:CFHT/2452990o.fits.fz')]:
+        plane = Plane(product_id)
+        artifact = Artifact(uri, ProductType.SCIENCE, ReleaseType.DATA)
+        part = Part('1')
+        chunk = Chunk()
+        chunk.energy = SpectralWCS(CoordAxis1D(Axis('WAVE', '1 / m')), 'TOPOCENT', bandpass_name='NONE')
+        part.chunks.append(chunk)
+        artifact.parts.add(part)
+        plane.artifacts.add(artifact)
+        observation.planes.add(plane)
+
+    instruments.InstrumentType.value_repair.repair_file(observation, storage_name)
+    assert observation.type == 'FRINGE', 'observation repair'
+    repaired = observation.planes['2452990p'].artifacts[storage_name.file_uri].parts['1'].chunks[0]
+    assert repaired.energy.bandpass_name is None, 'chunk repair'
+    assert repaired.energy.axis.axis.cunit == '/m', 'nested attribute repair'
+    other = observation.planes['2452990o'].artifacts['cadc:CFHT/2452990o.fits.fz'].parts['1'].chunks[0]
+    assert other.energy.bandpass_name == 'NONE', 'other planes are not repaired'
+    assert list(observation.planes.keys()) == ['2452990p', '2452990o'], 'planes restored'
+    assert len(observation.planes['2452990p'].artifacts) == 1, 'artifacts restored'
+
+
+def test_spirou_polarization_header_index(test_config):
+    storage_name = CFHTName(source_names=['2401734p.fits'], instrument=Inst.SPIROU)
+    primary = fits.Header()
+    pol = fits.Header()
+    pol['EXTNAME'] = 'Pol'
+    pol['STOKES'] = 'V'
+    pol['TOTETIME'] = 300.0
+    pol['MJDATE1'] = 58800.1
+    pol['MJDEND1'] = 58800.2
+    pol['MJDATE2'] = 58800.3
+    pol['MJDEND2'] = 58800.4
+    pol['MJDATE'] = 58800.0
+    duplicate = fits.Header()
+    duplicate['EXTNAME'] = 'Pol'
+    duplicate['STOKES'] = 'Q'
+    storage_name.metadata[storage_name.file_uri] = [primary, pol, duplicate]
+    test_subject = instruments.SpirouPolarization(storage_name, Mock(), Mock(), None, test_config)
+    test_subject.update_artifact()
+    assert test_subject._extname_headers['Pol'] is pol, 'first HDU wins'
+    assert test_subject._prefix_values['Pol'] == {
+        'MJDATE': [58800.1, 58800.3], 'MJDEND': [58800.2, 58800.4]
+    }, 'prefix values'
+    assert test_subject._prefix_values[None] == {'MJDATE': [], 'MJDEND': []}, 'primary'
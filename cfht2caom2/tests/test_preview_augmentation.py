@@ -68,10 +68,16 @@
 
 import glob
 import logging
+import numpy as np
 import os
+import shutil
 import traceback
 
-from cfht2caom2 import preview_augmentation
+from mock import Mock
+from PIL import Image
+
+from caom2 import Artifact, ChecksumURI, Plane, ProductType, ReleaseType, SimpleObservation
+from cfht2caom2 import preview_augmentation, preview_source
 from cfht2caom2 import metadata as md
 from cfht2caom2 import cfht_name
 from caom2pipe import manage_composable as mc
@@ -309,8 +315,77 @@ def test_preview_augment(test_config, test_data_dir):
                                 f'{artifact.content_checksum.uri}'
                             )
 
-    assert (
-        len(checksum_failures) == 0,
-        '\n'.join(ii for ii in checksum_failures),
-    )
+    assert len(checksum_failures) == 0, '\n'.join(checksum_failures)
     # assert False
+
+
+def test_spectrum_figure_reuse():
+    first = preview_augmentation._get_spectrum_figure()
+    first.add_subplot(1, 1, 1).plot([1.0, 2.0], [3.0, 4.0])
+    second = preview_augmentation._get_spectrum_figure()
+    assert first is second, 'one figure for all spectrum previews'
+    assert len(second.axes) == 0, 'figure is cleared on reuse'
+    assert second.get_size_inches().tolist() == [10.24, 10.24], 'size'
+
+
+def test_preview_skip_current(test_config, tmp_path):
+    test_config.preview_skip_current = True
+    test_config.preview_version = '2'
+    test_name = cfht_name.CFHTName(source_names=['/test_files/1151210o.fits.fz'], instrument=md.Inst.WIRCAM)
+    plane = Plane(test_name.product_id)
+    science = Artifact(test_name.file_uri, ProductType.SCIENCE, ReleaseType.DATA)
+    science.content_checksum = ChecksumURI('md5:abc')
+    for artifact in [
+        science,
+        Artifact(test_name.prev_uri, ProductType.PREVIEW, ReleaseType.DATA),
+        Artifact(test_name.thumb_uri, ProductType.THUMBNAIL, ReleaseType.META),
+    ]:
+        plane.artifacts.add(artifact)
+    obs = SimpleObservation('CFHT', test_name.obs_id)
+    obs.planes.add(plane)
+
+    # the thumbnail, as it is at CADC
+    stored_dir = tmp_path / 'stored'
+    stored_dir.mkdir()
+    stored_fqn = str(stored_dir / test_name.thumb)
+    Image.fromarray(np.zeros((256, 256), dtype=np.uint8)).save(stored_fqn, format='JPEG')
+    stored_source = preview_source.PreviewSource('md5:abc', '2', [test_name.prev_uri, test_name.thumb_uri])
+    preview_source.write(stored_fqn, stored_source)
+
+    working_dir = tmp_path / 'working'
+    working_dir.mkdir()
+    clients_mock = Mock()
+    clients_mock.data_client.get.side_effect = lambda directory, uri: shutil.copy(stored_fqn, directory)
+    kwargs = {
+        'working_directory': str(working_dir),
+        'storage_name': test_name,
+        'clients': clients_mock,
+        'config': test_config,
+    }
+
+    def _is_current():
+        return preview_augmentation.CFHTPreview(md.Inst.WIRCAM.value, None, None, None, **kwargs).is_current(obs)
+
+    assert _is_current(), 'same content, same version'
+    clients_mock.data_client.get.assert_called_with(str(working_dir), test_name.thumb_uri)
+    assert not (working_dir / test_name.thumb).exists(), 'retrieved thumbnail is cleaned up'
+
+    science.content_checksum = ChecksumURI('md5:def')
+    assert not _is_current(), 'content changed'
+    science.content_checksum = ChecksumURI('md5:abc')
+
+    test_config.preview_version = '3'
+    assert not _is_current(), 'generator changed'
+    test_config.preview_version = '2'
+
+    plane.artifacts.pop(test_name.prev_uri)
+    assert not _is_current(), 'preview removed'
+    plane.artifacts.add(Artifact(test_name.prev_uri, ProductType.PREVIEW, ReleaseType.DATA))
+
+    clients_mock.data_client.get.side_effect = mc.CadcException('not found')
+    assert not _is_current(), 'not retrievable'
+
+    test_config.preview_skip_current = False
+    clients_mock.data_client.get.reset_mock()
+    assert not _is_current(), 'off'
+    clients_mock.data_client.get.assert_not_called()
@@ -0,0 +1,248 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.visualization import simple_norm
+
+from cfht2caom2 import preview_render
+
+
+def test_parse_section():
+    assert preview_render.parse_section('[33:2080,1:4612]') == (33, 2080, 1, 4612), 'section'
+    assert preview_render.parse_section('[2080:33,4612:1]') == (2080, 33, 4612, 1), 'reversed section'
+    assert preview_render.parse_section('bad') is None, 'bad section'
+    assert preview_render.parse_section(None) is None, 'no section'
+
+
+def test_image_data():
+    primary = fits.PrimaryHDU()
+    cube = np.arange(2 * 6 * 8, dtype=np.int16).reshape(2, 6, 8)
+    extension = fits.ImageHDU(cube)
+    extension.header['DATASEC'] = '[2:7,1:5]'
+    hdu_list = fits.HDUList([primary, extension])
+    assert preview_render.image_count(hdu_list) == 1, 'count'
+    test_result = preview_render.image_data(hdu_list)
+    assert test_result.dtype == np.float32, 'dtype'
+    assert test_result.shape == (5, 6), 'first plane, trimmed to DATASEC'
+    assert test_result[0, 0] == 1.0, 'origin'
+    assert preview_render.image_data(hdu_list, 0) is None, 'no image in the primary HDU'
+
+
+def test_first_plane(tmp_path):
+    cube = np.arange(3 * 4 * 5, dtype=np.float32).reshape(3, 4, 5)
+    fqn = tmp_path / 'cube.fits'
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(cube), fits.CompImageHDU(cube)]).writeto(fqn)
+    with fits.open(fqn, memmap=True) as hdu_list:
+        for index in [1, 2]:
+            test_result = preview_render.first_plane(hdu_list[index])
+            assert test_result.shape == (4, 5), f'shape {index}'
+            np.testing.assert_array_equal(test_result, cube[0], f'values {index}')
+    in_memory = fits.ImageHDU(cube)
+    np.testing.assert_array_equal(preview_render.first_plane(in_memory), cube[0], 'in memory')
+
+
+def test_stretch():
+    data = np.array([[0.0, 5.0], [10.0, np.nan]], dtype=np.float32)
+    test_result = preview_render.stretch(data, 0.0, 10.0)
+    assert test_result.dtype == np.uint8, 'dtype'
+    # the first FITS row is displayed at the bottom, low values are white
+    assert test_result[1, 0] == 255, 'low'
+    assert test_result[1, 1] == 191, 'squared'
+    assert test_result[0, 0] == 0, 'high'
+    assert test_result[0, 1] == preview_render.BACKGROUND, 'nan'
+    rotated = preview_render.stretch(data, 0.0, 10.0, rotate=True)
+    assert (rotated == test_result[::-1, ::-1]).all(), 'rotate'
+    assert preview_render.scale_limits(data, 'minmax') == (0.0, 10.0), 'minmax'
+
+
+def test_fit_and_pan():
+    data = np.arange(4096 * 2048, dtype=np.float32).reshape(4096, 2048)
+    factor = preview_render.reduction_factor(data.shape, preview_render.PREVIEW_SIZE)
+    assert factor == 4, 'factor'
+    reduced = preview_render.block_average(data, factor)
+    assert reduced.shape == (1024, 512), 'block average'
+    assert reduced[0, 0] == data[0:4, 0:4].mean(), 'block mean'
+    image = preview_render.fit(preview_render.stretch(reduced, 0.0, data.max()), preview_render.THUMBNAIL_SIZE)
+    assert image.size == (256, 256), 'fit size'
+    # the 128 x 256 image is centred, on a white background
+    assert image.getpixel((10, 128)) == (255, 255, 255), 'background'
+
+    zoom = preview_render.pan(data, 1024, 1024.0, 0.0)
+    assert zoom.shape == (1024, 1024), 'pan size'
+    assert np.isnan(zoom[:, 512:]).all(), 'outside the image'
+    assert zoom[0, 0] == data[1536, 1536], 'pan origin'
+
+
+def test_mosaic(tmp_path):
+    hdus = [fits.PrimaryHDU()]
+    for index, (detsec, value) in enumerate(
+        [('[1:100,1:200]', 1.0), ('[101:200,1:200]', 2.0), ('[200:101,201:400]', 3.0), ('[1:100,201:400]', 4.0)]
+    ):
+        data = np.full((200, 110), value, dtype=np.float32)
+        # the overscan is excluded by DATASEC
+        data[:, 100:] = 1000.0
+        data[0, 0] = value + 0.5
+        hdu = fits.ImageHDU(data)
+        hdu.header['DATASEC'] = '[1:100,1:200]'
+        hdu.header['DETSEC'] = detsec
+        hdus.append(hdu)
+    fqn = tmp_path / 'mosaic.fits'
+    fits.HDUList(hdus).writeto(fqn)
+
+    canvas, low, high = preview_render.mosaic(fqn.as_posix(), 100, scale_mode='minmax', workers=3)
+    assert canvas.shape == (100, 50), 'reduced by 4'
+    assert (low, high) == (1.0, 4.5), 'global limits exclude the overscan'
+    assert canvas[0, 0] == 1.03125, 'lower left'
+    assert canvas[0, 25] == 2.03125, 'lower right'
+    assert canvas[50, 0] == 4.03125, 'upper left'
+    # the reversed DETSEC flips the CCD
+    assert canvas[50, 49] == 3.03125, 'upper right'
+
+    canvas, low, high = preview_render.mosaic(fqn.as_posix(), 100, scale_mode='minmax', scope='local', workers=1)
+    assert (low, high) == (0.0, 1.0), 'local limits'
+    assert canvas[0, 1] == 0.0, 'normalized by CCD'
+
+    hdus[1].header['DETSEC'] = 'unknown'
+    fits.HDUList(hdus).writeto(fqn, overwrite=True)
+    assert preview_render.mosaic(fqn.as_posix(), 100) is None, 'no DETSEC'
+
+
+def _whole_cube_reduction(data):
+    # the original, whole-cube, genSiteprevperplane.py reduction
+    data = data[:, 8:2056]
+    nspecaxis = data.shape[0]
+    numedgechannels = int(0.15 * nspecaxis)
+    data[:numedgechannels, :, :] = 0.0
+    data[(-1 * numedgechannels) :, :, :] = 0.0
+    data2d = np.reshape(data, (nspecaxis, -1))
+    for k in range(nspecaxis):
+        data2d[k, :] = data2d[k, :] - np.median(data2d[k, :])
+    meanbgsubvswavenumber = np.mean(data2d, axis=1)
+    indexmax1 = np.nanargmax(meanbgsubvswavenumber)
+    meanbgsubvswavenumber[indexmax1 - 3 : indexmax1 + 3] = 0.0
+    indexmax2 = np.nanargmax(meanbgsubvswavenumber)
+    meanbgsubvswavenumber[indexmax2 - 3 : indexmax2 + 3] = 0.0
+    w = np.where(meanbgsubvswavenumber > 0.0)
+    data2dline1 = np.mean(data[indexmax1 - 1 : indexmax1 + 1], axis=0)
+    data2dline2 = np.mean(data[indexmax2 - 1 : indexmax2 + 1], axis=0)
+    data2dcont = np.mean(data[w[0]], axis=0)
+    return data2dline1 + data2dcont, data2dline2 + data2dcont, data2dcont
+
+
+def test_reduce_sitelle_cube(tmp_path):
+    rng = np.random.default_rng(2359320)
+    cube = rng.normal(10.0, 3.0, (30, 2070, 32)).astype(np.float32)
+    cube[15] += 5.0
+    cube[10] += 3.0
+    fqn = tmp_path / 'cube.fits'
+    fits.writeto(fqn, cube)
+
+    expected = _whole_cube_reduction(cube.copy())
+    with fits.open(fqn, memmap=True) as hdu_list:
+        test_result = preview_render.reduce_sitelle_cube(hdu_list[0], chunk_channels=4)
+    for name, actual, wanted in zip(['line 1', 'line 2', 'continuum'], test_result, expected):
+        assert actual.shape == (2048, 32), f'{name} shape'
+        assert np.array_equal(actual, wanted), f'{name} is the same as for the whole cube'
+
+
+def test_rgb():
+    rng = np.random.default_rng(1)
+    red, green, blue = (rng.normal(100.0, 20.0, (64, 32)).astype(np.float32) for _ in range(3))
+    red[0, 0] = np.nan
+    test_result = preview_render.rgb(red, green, blue)
+    assert test_result.mode == 'RGB', 'mode'
+    assert test_result.size == (32, 64), 'size'
+    pixels = np.asarray(test_result)
+
+    # the aplpy.make_rgb_image stretch, flipped so the first FITS row is at the bottom
+    for index, (data, low, high) in enumerate([(red, 50.0, 99.5), (green, 95.0, 99.5), (blue, 50.0, 99.5)]):
+        norm = simple_norm(data, 'linear', min_percent=low, max_percent=high)
+        expected = np.nan_to_num(norm(data, clip=True).filled(0))
+        expected = np.clip(expected * 255.0, 0.0, 255.0).astype(np.uint8)[::-1]
+        assert np.array_equal(pixels[:, :, index], expected), f'channel {index}'
+
+
+def test_reduce_dataset():
+    rng = np.random.default_rng(11)
+    dataset = rng.uniform(1.0e4, 1.0e6, (1030, 1100)).astype(np.float32)
+    test_result = preview_render.reduce_dataset(dataset, 256, chunk_rows=50)
+    assert test_result.shape == (257, 275), 'reduced by 4, ragged edges dropped'
+    np.testing.assert_allclose(test_result, preview_render.block_average(dataset, 4), rtol=1e-6)
+
+
+def test_colour_map():
+    data = np.array([[4.0, 4.5, 5.0], [5.5, 6.0, np.nan], [-np.inf, 5.0, 5.0]])
+    test_result = np.asarray(preview_render.colour_map(data, 4.5, 5.5))
+    assert test_result.shape == (3, 3, 3), 'RGB'
+    np.testing.assert_array_equal(test_result[0, 0], test_result[0, 1], 'clipped low')
+    np.testing.assert_array_equal(test_result[1, 0], test_result[1, 1], 'clipped high')
+    np.testing.assert_array_equal(test_result[2, 0], test_result[0, 1], '-inf is low')
+    np.testing.assert_array_equal(test_result[1, 2], [255, 255, 255], 'NaN is background')
+    assert not np.array_equal(test_result[0, 1], test_result[1, 0]), 'ends of the colour map differ'
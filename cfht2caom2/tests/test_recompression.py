@@ -0,0 +1,133 @@
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2026.                            (c) 2026.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import gzip
+import numpy as np
+
+from astropy.io import fits
+
+from cfht2caom2 import recompression
+
+
+def test_recompress(tmp_path):
+    rng = np.random.default_rng(7)
+    unsigned = rng.normal(30000.0, 300.0, (64, 80)).astype(np.uint16)
+    floats = rng.normal(0.0, 1.0, (32, 40)).astype(np.float32)
+    cube = rng.integers(-100, 100, (3, 16, 16)).astype(np.int32)
+    signed_bytes = rng.integers(-128, 128, (16, 16)).astype(np.int8)
+    primary = fits.PrimaryHDU(unsigned)
+    primary.header['OBJECT'] = 'test'
+    hdu_list = fits.HDUList(
+        [
+            primary,
+            fits.ImageHDU(floats, name='FLOATS'),
+            fits.ImageHDU(cube, name='CUBE'),
+            fits.ImageHDU(signed_bytes, name='BYTES'),
+            fits.BinTableHDU.from_columns([fits.Column(name='c', format='E', array=np.arange(3.0))], name='TABLE'),
+        ]
+    )
+    source_fqn = str(tmp_path / 'test.fits.gz')
+    with gzip.open(source_fqn, 'wb') as f:
+        hdu_list.writeto(f)
+    assert recompression.can_recompress([hdu.header for hdu in hdu_list]), 'unsigned integers, signed bytes'
+
+    dest_fqn = str(tmp_path / 'test.fits.fz')
+    recompression.recompress(source_fqn, dest_fqn, workers=2)
+    with fits.open(dest_fqn, checksum=True) as test_result:
+        assert len(test_result) == 6, 'the primary image moves to an extension'
+        assert test_result[0].data is None, 'empty primary'
+        assert isinstance(test_result[1], fits.CompImageHDU), 'compressed'
+        assert test_result[1].header.get('OBJECT') == 'test', 'primary keywords move with the image'
+        np.testing.assert_array_equal(test_result[1].data, unsigned, 'unsigned')
+        np.testing.assert_array_equal(test_result['FLOATS'].data, floats, 'lossless floats')
+        np.testing.assert_array_equal(test_result['CUBE'].data, cube, 'cube')
+        np.testing.assert_array_equal(test_result['BYTES'].data, signed_bytes, 'signed bytes')
+        np.testing.assert_array_equal(test_result['TABLE'].data['c'], np.arange(3.0), 'table')
+
+    dest_fqn = str(tmp_path / 'test.fits')
+    recompression.decompress(source_fqn, dest_fqn)
+    np.testing.assert_array_equal(fits.getdata(dest_fqn, 'CUBE'), cube, 'decompressed')
+
+
+def test_can_recompress():
+    header = fits.Header()
+    header['BITPIX'] = 16
+    header['NAXIS'] = 2
+    header['BSCALE'] = 2.0
+    assert not recompression.can_recompress([header]), 'scaled'
+    header['BSCALE'] = 1.0
+    header['BZERO'] = 100.0
+    assert not recompression.can_recompress([header]), 'offset'
+    header['BZERO'] = 32768
+    assert recompression.can_recompress([header]), 'unsigned'
+    header['BITPIX'] = 8
+    assert not recompression.can_recompress([header]), 'bytes offset'
+    header['BZERO'] = 128
+    assert not recompression.can_recompress([header]), 'bytes are already unsigned'
+    header['BZERO'] = -128
+    assert recompression.can_recompress([header]), 'signed bytes'
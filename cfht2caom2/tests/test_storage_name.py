@@ -66,11 +66,19 @@
 # ***********************************************************************
 #
 
+import gzip
+import numpy as np
+import os
+
+from astropy.io import fits
 from glob import glob
+from unittest.mock import Mock, patch
 
 from caom2utils.data_util import get_local_file_headers
+from caom2pipe.execute_composable import NoFheadStoreVisitRunnerMeta
 from caom2pipe.manage_composable import StorageName
 from cfht2caom2 import CFHTName
+from cfht2caom2 import cfht_name
 
 
 def test_is_valid(test_config):
@@ -305,3 +313,60 @@ def test_suffixes(test_data_dir, test_config):
                     assert not test_subject.simple, f'not simple {test_subject}'
                     found_one = True
                 assert found_one, f'{entry} neither derived nor simple {test_subject}'
+
+
+def test_store_recompressed(tmp_path):
+    # the files written by the in-process recompression are stored, then removed
+    source_fqn = str(tmp_path / '2463796o.fits.gz')
+    hdu_list = fits.HDUList([fits.PrimaryHDU(np.arange(64, dtype=np.int16).reshape(8, 8))])
+    with gzip.open(source_fqn, 'wb') as f:
+        hdu_list.writeto(f)
+    working_dir = tmp_path / 'working'
+    uri = 'cadc:CFHT/2463796o.fits.fz'
+    recompressed_fqn = str(working_dir / '2463796o.fits.fz')
+
+    test_subject = cfht_name.CFHTStoreIngestRunnerMeta.__new__(cfht_name.CFHTStoreIngestRunnerMeta)
+    test_subject._logger = Mock()
+    test_subject._working_dir = str(working_dir)
+    test_subject._recompression_workers = 2
+    test_subject._recompressed = []
+    test_subject._storage_name = Mock(
+        source_names=[source_fqn], destination_uris=[uri], metadata={uri: [hdu_list[0].header]}
+    )
+    stored = []
+
+    def _store_data(runner):
+        stored.extend(runner._storage_name.source_names)
+        assert os.path.exists(recompressed_fqn), 'recompressed before storing'
+
+    with patch.object(NoFheadStoreVisitRunnerMeta, '_store_data', _store_data):
+        test_subject._store_data()
+    assert stored == [recompressed_fqn], 'stores the recompressed file'
+    assert test_subject._storage_name.source_names == [source_fqn], 'source names restored'
+    assert not os.path.exists(recompressed_fqn), 'recompressed file removed'
+    assert os.path.exists(source_fqn), 'source left for the source clean up'
+
+
+def test_store_ingest_overlap_failures():
+    # when both the mapping and the overlapping store fail, the mapping failure is raised, and the store failure is
+    # logged
+    test_subject = cfht_name.CFHTStoreIngestRunnerMeta.__new__(cfht_name.CFHTStoreIngestRunnerMeta)
+    test_subject._logger = Mock()
+    test_subject._overlap_store = True
+    test_subject._storage_name = Mock(
+        file_name='1000003f.fits.fz',
+        source_names=['/data/1000003f.fits.fz'],
+        destination_uris=['cadc:CFHT/1000003f.fits.fz'],
+    )
+    test_subject._set_preconditions = Mock()
+    test_subject._store_data = Mock(side_effect=OSError('put failed'))
+    test_subject._caom2_read = Mock(side_effect=ValueError('read failed'))
+    test_subject._caom2_store = Mock()
+    with patch.object(cfht_name.CFHTStoreIngestRunnerMeta, 'storage_name', create=True):
+        try:
+            test_subject.execute({'storage_name': test_subject._storage_name})
+            assert False, 'expect a failure'
+        except ValueError as e:
+            assert str(e) == 'read failed', 'mapping failure'
+    test_subject._logger.error.assert_called_with('Store of 1000003f.fits.fz failed: put failed')
+    test_subject._caom2_store.assert_not_called()